@@ -0,0 +1,50 @@
+import json
+import hashlib
+from typing import Dict, Any
+
+from adb import async_connection, fetchrow, run_sync
+from db import statement
+from index import PREFLIGHT, SELECT_LOGIN, handler, login_response, too_many_requests
+from instrumentation import instrumented, phase
+from ratelimit import RATE_LIMIT_BACKEND, check_local, limit_keys
+from response import json_response
+
+
+@instrumented
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Async entry point of the auth function for self-hosting - login on asyncpg,
+              registration and shared rate limiting run the sync handler in a thread
+    Args: event - dict with httpMethod, body, queryStringParameters
+          context - object with request_id, function_name attributes
+    Returns: HTTP response dict, the same as handler returns for the event
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return PREFLIGHT
+    
+    if method == 'POST' and RATE_LIMIT_BACKEND != 'postgres':
+        with phase('json_decode'):
+            body_data = json.loads(event.get('body', '{}'))
+        
+        if body_data.get('action') == 'login':
+            email = body_data.get('email', '')
+            password = body_data.get('password', '')
+            
+            retry_after = check_local(limit_keys(event, email))
+            
+            if retry_after:
+                return too_many_requests(retry_after)
+            
+            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            
+            async with async_connection() as conn:
+                user = await fetchrow(conn, statement(SELECT_LOGIN), email, password_hash)
+            
+            if not user:
+                return json_response(401, {'error': 'Неверный email или пароль'})
+            
+            return login_response(user)
+    
+    return await run_sync(handler.__wrapped__, event, context)
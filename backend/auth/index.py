@@ -1,11 +1,45 @@
 import json
-import os
 import hashlib
-from typing import Dict, Any
+import math
+from typing import Dict, Any, Tuple
 
+from db import connection, execute_prepared, prepare, prewarm
+from instrumentation import instrumented, phase
+from ratelimit import check_local, check_shared, limit_keys
+from response import METHOD_NOT_ALLOWED, json_response, preflight_response
+from tokens import issue_token
+
+SELECT_LOGIN = prepare(
+    'select_login',
+    "SELECT id, email, user_type, is_verified FROM users WHERE email = $1 AND password_hash = $2"
+)
+
+PREFLIGHT = preflight_response('GET, POST, OPTIONS', 'Content-Type, X-User-Id, X-Auth-Token')
+
+
+def too_many_requests(retry_after: float) -> Dict[str, Any]:
+    return json_response(
+        429,
+        {'error': 'Слишком много попыток, попробуйте позже'},
+        {'Retry-After': str(max(1, math.ceil(retry_after))), 'Access-Control-Expose-Headers': 'Retry-After'}
+    )
+
+
+def login_response(user: Tuple[Any, ...]) -> Dict[str, Any]:
+    '''Successful login answer for a row selected with SELECT_LOGIN'''
+    return json_response(200, {
+        'user_id': user[0],
+        'email': user[1],
+        'user_type': user[2],
+        'is_verified': user[3] if user[3] is not None else False,
+        'token': issue_token(user[0], user[2], bool(user[3]))
+    })
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: User authentication and registration with special code validation
+    Business: User authentication and registration with special code validation, rate limited per IP and email
     Args: event - dict with httpMethod, body, queryStringParameters
           context - object with request_id, function_name attributes
     Returns: HTTP response dict with user data or error
@@ -13,137 +47,78 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return PREFLIGHT
     
     if method == 'POST':
-        import psycopg2
-        
-        body_data = json.loads(event.get('body', '{}'))
+        with phase('json_decode'):
+            body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action')
         
-        db_url = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
+        limits = limit_keys(event, body_data.get('email', '') if action in ('register', 'login') else '')
+        retry_after = check_local(limits)
         
-        if action == 'register':
-            email = body_data.get('email', '')
-            password = body_data.get('password', '')
-            user_type = body_data.get('user_type', 'regular')
-            special_code = body_data.get('special_code', '')
-            
-            if user_type == 'special' and special_code != '669':
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Неверный код для особого пользователя'})
-                }
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "SELECT id FROM users WHERE email = %s",
-                (email,)
-            )
-            
-            if cur.fetchone():
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Email уже зарегистрирован'})
-                }
-            
-            is_verified = user_type == 'special'
-            
-            cur.execute(
-                "INSERT INTO users (email, password_hash, user_type, is_verified) VALUES (%s, %s, %s, %s) RETURNING id",
-                (email, password_hash, user_type, is_verified)
-            )
+        if retry_after:
+            return too_many_requests(retry_after)
+        
+        with connection() as conn:
+            cur = conn.cursor()
             
-            user_id = cur.fetchone()[0]
+            retry_after = check_shared(cur, limits)
             conn.commit()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({
+            if retry_after:
+                return too_many_requests(retry_after)
+            
+            if action == 'register':
+                email = body_data.get('email', '')
+                password = body_data.get('password', '')
+                user_type = body_data.get('user_type', 'regular')
+                special_code = body_data.get('special_code', '')
+                
+                if user_type == 'special' and special_code != '669':
+                    return json_response(400, {'error': 'Неверный код для особого пользователя'})
+                
+                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                
+                is_verified = user_type == 'special'
+                
+                cur.execute(
+                    "INSERT INTO users (email, password_hash, user_type, is_verified) VALUES (%s, %s, %s, %s) "
+                    "ON CONFLICT (email) DO NOTHING RETURNING id",
+                    (email, password_hash, user_type, is_verified)
+                )
+                
+                row = cur.fetchone()
+                
+                if not row:
+                    return json_response(400, {'error': 'Email уже зарегистрирован'})
+                
+                user_id = row[0]
+                conn.commit()
+                
+                return json_response(200, {
                     'user_id': user_id,
                     'email': email,
                     'user_type': user_type,
-                    'is_verified': is_verified
+                    'is_verified': is_verified,
+                    'token': issue_token(user_id, user_type, is_verified)
                 })
-            }
-        
-        elif action == 'login':
-            email = body_data.get('email', '')
-            password = body_data.get('password', '')
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "SELECT id, email, user_type, is_verified FROM users WHERE email = %s AND password_hash = %s",
-                (email, password_hash)
-            )
             
-            user = cur.fetchone()
-            conn.close()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Неверный email или пароль'})
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'user_id': user[0],
-                    'email': user[1],
-                    'user_type': user[2],
-                    'is_verified': user[3] if user[3] is not None else False
-                })
-            }
-        
-        conn.close()
+            elif action == 'login':
+                email = body_data.get('email', '')
+                password = body_data.get('password', '')
+                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                
+                execute_prepared(cur, SELECT_LOGIN, (email, password_hash))
+                
+                user = cur.fetchone()
+                
+                if not user:
+                    return json_response(401, {'error': 'Неверный email или пароль'})
+                
+                return login_response(user)
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    return METHOD_NOT_ALLOWED
+
+
+prewarm()
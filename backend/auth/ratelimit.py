@@ -0,0 +1,138 @@
+'''
+Token-bucket rate limiting for the auth endpoints.
+
+Every key (client IP, SHA-256 of the email) owns a bucket holding up to
+`burst` tokens that refills at `per_minute` tokens per minute; a request
+takes one token and is rejected when the bucket is empty. The client IP is
+the source address the platform reports, a request without one is limited
+per email only. Buckets always live in an in-process LRU, which stops a
+storm hitting one warm instance before it checks out a DB connection or
+hashes a password. In the "postgres" mode the same buckets are also kept in
+rate_limit_buckets and updated with one upsert, so the limit holds across
+all instances of the function.
+
+Configuration (environment):
+    RATE_LIMIT_BACKEND            - "memory" (default) or "postgres"
+    RATE_LIMIT_IP_BURST           - bucket size per client IP, default 20, 0 disables
+    RATE_LIMIT_IP_PER_MINUTE      - refill per client IP, default 30
+    RATE_LIMIT_EMAIL_BURST        - bucket size per email, default 5, 0 disables
+    RATE_LIMIT_EMAIL_PER_MINUTE   - refill per email, default 5
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+BUCKET_CACHE_SIZE = 100000
+SHARED_CLEANUP_INTERVAL = 600
+NO_REFILL_RETRY_AFTER = 3600.0
+
+
+class TokenBucketLimiter:
+    '''In-process token buckets keyed by string, least recently used keys are evicted'''
+
+    def __init__(self, name: str, burst: float, per_minute: float, max_keys: int = BUCKET_CACHE_SIZE):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.burst > 0
+
+    def _retry_after(self, tokens: float) -> float:
+        return (1 - tokens) / self.rate if self.rate > 0 else NO_REFILL_RETRY_AFTER
+
+    def take(self, key: str) -> float:
+        '''Take a token for key, return 0 when allowed or seconds until the next token'''
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else self._retry_after(tokens)
+
+    def take_shared(self, cur: Any, key: str) -> float:
+        '''Same as take() against the rate_limit_buckets table shared by all instances'''
+        if not self.enabled:
+            return 0.0
+        refilled = "LEAST(%(burst)s, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s)"
+        cur.execute(
+            "INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at, allowed) "
+            "VALUES (%(key)s, %(burst)s - 1, clock_timestamp(), %(burst)s >= 1) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            f"tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END, "
+            f"allowed = {refilled} >= 1, "
+            "updated_at = clock_timestamp() "
+            "RETURNING tokens, allowed",
+            {'key': f'{self.name}:{key}', 'burst': self.burst, 'rate': self.rate}
+        )
+        tokens, allowed = cur.fetchone()
+        return 0.0 if allowed else self._retry_after(tokens)
+
+
+ip_limiter = TokenBucketLimiter(
+    'ip',
+    float(os.environ.get('RATE_LIMIT_IP_BURST', '20')),
+    float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '30'))
+)
+email_limiter = TokenBucketLimiter(
+    'email',
+    float(os.environ.get('RATE_LIMIT_EMAIL_BURST', '5')),
+    float(os.environ.get('RATE_LIMIT_EMAIL_PER_MINUTE', '5'))
+)
+
+_last_cleanup = float('-inf')
+
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Source address the platform saw, None without one. X-Forwarded-For is
+    set by the client and would give it a fresh bucket on every request.
+    '''
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or None
+
+
+def limit_keys(event: Dict[str, Any], email: Any) -> List[Tuple[TokenBucketLimiter, str]]:
+    '''
+    Buckets a request takes a token from. The email is hashed, so a key of
+    any request body fits rate_limit_buckets.key.
+    '''
+    keys = []
+    ip = client_ip(event)
+    if ip:
+        keys.append((ip_limiter, ip))
+    if email and isinstance(email, str):
+        keys.append((email_limiter, hashlib.sha256(email.strip().lower().encode()).hexdigest()))
+    return keys
+
+
+def check_local(keys: List[Tuple[TokenBucketLimiter, str]]) -> float:
+    '''Seconds to wait before retrying, 0 when every in-process bucket allowed the request'''
+    return max([limiter.take(key) for limiter, key in keys], default=0.0)
+
+
+def check_shared(cur: Any, keys: List[Tuple[TokenBucketLimiter, str]]) -> float:
+    '''check_local() against the shared buckets, a no-op unless RATE_LIMIT_BACKEND is "postgres"'''
+    global _last_cleanup
+    if RATE_LIMIT_BACKEND != 'postgres':
+        return 0.0
+    retry_after = max([limiter.take_shared(cur, key) for limiter, key in keys], default=0.0)
+    if time.monotonic() - _last_cleanup >= SHARED_CLEANUP_INTERVAL:
+        _last_cleanup = time.monotonic()
+        cur.execute("DELETE FROM rate_limit_buckets WHERE updated_at < clock_timestamp() - interval '1 day'")
+    return retry_after
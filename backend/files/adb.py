@@ -0,0 +1,111 @@
+'''
+asyncpg pool and helpers for the async entry points (handler_async).
+
+The platform calls the synchronous handler; handler_async exists for
+self-hosting on an event loop (see server/asgi.py), where one process serves
+many requests concurrently. asyncpg is imported on first use only, so the
+platform never loads it. Queries reuse the SQL of the sync code: statements
+registered with db.prepare() already use $n placeholders, and %s-style
+queries are converted with to_asyncpg(). Actions without an async
+implementation run the sync handler in a worker thread via run_sync(),
+bounded by the psycopg2 pool size.
+
+Configuration (environment):
+    DATABASE_URL            - connection string
+    ASYNC_POOL_MIN_SIZE     - connections kept open, default 1
+    ASYNC_POOL_MAX_SIZE     - upper bound of open connections, default 20
+'''
+import asyncio
+import functools
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from db import DATABASE_URL, POOL_MAX_SIZE
+from instrumentation import phase, record_query
+
+ASYNC_POOL_MIN_SIZE = int(os.environ.get('ASYNC_POOL_MIN_SIZE', '1'))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_POOL_MAX_SIZE', '20'))
+
+_PLACEHOLDER = re.compile(r'%%|%s')
+
+_pool: Optional[Any] = None
+_pool_lock: Optional[asyncio.Lock] = None
+_sync_slots: Optional[asyncio.Semaphore] = None
+
+
+@functools.lru_cache(maxsize=256)
+def to_asyncpg(query: str) -> str:
+    '''Rewrite psycopg2 %s placeholders as $1, $2... and %% as %'''
+    counter = iter(range(1, query.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f'${next(counter)}', query)
+
+
+async def get_async_pool() -> Any:
+    '''Return the module-level asyncpg pool, creating it on first call'''
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                import asyncpg
+                _pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=ASYNC_POOL_MIN_SIZE,
+                    max_size=max(ASYNC_POOL_MIN_SIZE, ASYNC_POOL_MAX_SIZE)
+                )
+    return _pool
+
+
+async def close_async_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def async_connection() -> AsyncIterator[Any]:
+    with phase('connect'):
+        pool = await get_async_pool()
+        conn = await pool.acquire()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def fetch(conn: Any, query: str, *args: Any) -> List[Any]:
+    started = time.perf_counter()
+    rows = await conn.fetch(query, *args)
+    record_query(time.perf_counter() - started, len(rows))
+    return rows
+
+
+async def fetchrow(conn: Any, query: str, *args: Any) -> Optional[Any]:
+    started = time.perf_counter()
+    row = await conn.fetchrow(query, *args)
+    record_query(time.perf_counter() - started, 1 if row is not None else 0)
+    return row
+
+
+async def execute(conn: Any, query: str, *args: Any) -> None:
+    started = time.perf_counter()
+    await conn.execute(query, *args)
+    record_query(time.perf_counter() - started, 0)
+
+
+async def run_sync(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]],
+                   event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Run a synchronous handler in a worker thread. At most POOL_MAX_SIZE run
+    at once so they never exhaust the psycopg2 pool.
+    '''
+    global _sync_slots
+    if _sync_slots is None:
+        _sync_slots = asyncio.Semaphore(POOL_MAX_SIZE)
+    async with _sync_slots:
+        return await asyncio.to_thread(handler, event, context)
@@ -0,0 +1,103 @@
+import json
+from typing import Dict, Any
+
+from adb import async_connection, execute, fetch, fetchrow, run_sync, to_asyncpg
+from db import statement
+from downloads import (DOWNLOAD_FLUSH_BATCH, EXPIRE_RANKINGS, FLUSH_DOWNLOAD_EVENTS, INSERT_DOWNLOAD_EVENT,
+                       SELECT_FILE_DOWNLOAD, cached_file_download, download_body, flush_due, remember_file_download)
+from index import (PREFLIGHT, SELECT_CATALOGUE_VERSION, etag_matches, handler, list_files_body, list_files_query,
+                   listing_response, not_modified, page_cache, parse_listing, search_files_page, search_files_query,
+                   top_files_query)
+from instrumentation import instrumented, phase
+from response import dumps, json_response
+
+
+async def flush_download_events(conn: Any) -> None:
+    '''Async counterpart of downloads.flush_download_events'''
+    async with conn.transaction():
+        await execute(conn, statement(FLUSH_DOWNLOAD_EVENTS), DOWNLOAD_FLUSH_BATCH)
+        await execute(conn, statement(EXPIRE_RANKINGS))
+
+
+@instrumented
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Async entry point of the files function for self-hosting - catalogue listing,
+              search and download tracking on asyncpg, other requests run the sync handler in a thread
+    Args: event - dict with httpMethod, body, queryStringParameters, headers
+          context - object with request_id attribute
+    Returns: HTTP response dict, the same as handler returns for the event
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'OPTIONS':
+        return PREFLIGHT
+    
+    if method == 'GET' and not params.get('download') and not params.get('export'):
+        try:
+            listing = parse_listing(params)
+        except (ValueError, TypeError):
+            return json_response(400, {'error': 'Некорректные параметры запроса'})
+        
+        async with async_connection() as conn:
+            if listing[1] == 'top' and flush_due():
+                await flush_download_events(conn)
+            
+            version = await fetchrow(conn, statement(SELECT_CATALOGUE_VERSION))
+            etag = f'"{version[0]}"'
+            
+            if etag_matches(event, etag):
+                return not_modified(etag)
+            
+            page_key = (etag,) + listing
+            body = page_cache.get(page_key)
+            
+            if body is None:
+                if listing[0]:
+                    query, args = search_files_query(*listing[:8])
+                    page = search_files_page(await fetch(conn, to_asyncpg(query), *args), listing[2])
+                    
+                    with phase('json_encode'):
+                        body = dumps(page)
+                else:
+                    if listing[1] == 'top':
+                        query, args = top_files_query(listing[8], *listing[2:8])
+                    else:
+                        query, args = list_files_query(*listing[2:8])
+                    body = list_files_body(await fetchrow(conn, to_asyncpg(query), *args))
+                
+                page_cache.set(page_key, body)
+        
+        return listing_response(etag, body)
+    
+    if method == 'POST':
+        with phase('json_decode'):
+            body_data = json.loads(event.get('body', '{}'))
+        
+        if body_data.get('action') == 'download':
+            try:
+                file_id = int(body_data.get('file_id'))
+            except (TypeError, ValueError):
+                return json_response(404, {'error': 'Файл не найден'})
+            
+            async with async_connection() as conn:
+                download = cached_file_download(file_id)
+                
+                if download is None:
+                    row = await fetchrow(conn, statement(SELECT_FILE_DOWNLOAD), file_id)
+                    
+                    if not row:
+                        return json_response(404, {'error': 'Файл не найден'})
+                    
+                    download = tuple(row)
+                    remember_file_download(file_id, download)
+                
+                await execute(conn, statement(INSERT_DOWNLOAD_EVENT), file_id)
+                
+                if flush_due():
+                    await flush_download_events(conn)
+            
+            return json_response(200, download_body(download))
+    
+    return await run_sync(handler.__wrapped__, event, context)
@@ -0,0 +1,151 @@
+'''
+Write-behind download counter.
+
+A download only appends a row to download_events and reads the file URL,
+so the hot path never locks the files row. Pending events are folded into
+files.downloads_count in batches by flush_download_events, which runs at
+most once per DOWNLOAD_FLUSH_INTERVAL seconds per warm process.
+
+The same flush keeps the precomputed rankings behind the "top" listing up to
+date. Events are added to hourly download_buckets and to file_rankings of
+every window (24h, 7d, all) whose expired_through watermark they are not
+older than. Windows then slide by subtracting the buckets that fell out of
+them and moving the watermark forward, so no ranking is ever recomputed
+from scratch and buckets older than the longest window are dropped.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from db import execute_prepared, prepare
+
+DOWNLOAD_FLUSH_INTERVAL = float(os.environ.get('DOWNLOAD_FLUSH_INTERVAL', '30'))
+DOWNLOAD_FLUSH_BATCH = int(os.environ.get('DOWNLOAD_FLUSH_BATCH', '5000'))
+FILE_DOWNLOAD_CACHE_SIZE = 1024
+
+SELECT_FILE_DOWNLOAD = prepare('select_file_download', "SELECT file_url, blob_sha256, crc32 FROM files WHERE id = $1")
+INSERT_DOWNLOAD_EVENT = prepare('insert_download_event', "INSERT INTO download_events (file_id) VALUES ($1)")
+FLUSH_DOWNLOAD_EVENTS = prepare(
+    'flush_download_events',
+    "WITH moved AS ("
+    "DELETE FROM download_events WHERE id = ANY(ARRAY("
+    "SELECT id FROM download_events ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED"
+    ")) RETURNING file_id, created_at"
+    "), counts AS ("
+    "SELECT m.file_id, f.user_id, date_trunc('hour', m.created_at) AS hour, COUNT(*) AS n "
+    "FROM moved m JOIN files f ON f.id = m.file_id GROUP BY 1, 2, 3"
+    "), buckets AS ("
+    "INSERT INTO download_buckets (hour, file_id, downloads) SELECT hour, file_id, n FROM counts "
+    "ON CONFLICT (hour, file_id) DO UPDATE SET downloads = download_buckets.downloads + EXCLUDED.downloads"
+    "), windows AS ("
+    # FOR SHARE waits for a concurrent expire_rankings, whose new watermark then applies
+    "SELECT period, expired_through FROM ranking_windows FOR SHARE"
+    "), ranked AS ("
+    "INSERT INTO file_rankings (period, file_id, uploader_id, downloads) "
+    "SELECT w.period, c.file_id, c.user_id, SUM(c.n) FROM counts c JOIN windows w ON c.hour >= w.expired_through "
+    "GROUP BY w.period, c.file_id, c.user_id "
+    "ON CONFLICT (period, file_id) DO UPDATE SET downloads = file_rankings.downloads + EXCLUDED.downloads"
+    ") "
+    "UPDATE files f SET downloads_count = f.downloads_count + t.n "
+    "FROM (SELECT file_id, SUM(n) AS n FROM counts GROUP BY file_id) t "
+    "WHERE f.id = t.file_id"
+)
+EXPIRE_RANKINGS = prepare(
+    'expire_rankings',
+    "WITH due AS ("
+    "SELECT period, expired_through, date_trunc('hour', LOCALTIMESTAMP) - span AS horizon FROM ranking_windows "
+    "WHERE expired_through < date_trunc('hour', LOCALTIMESTAMP) - span FOR UPDATE SKIP LOCKED"
+    "), expired AS ("
+    "SELECT d.period, b.file_id, SUM(b.downloads) AS n FROM due d "
+    "JOIN download_buckets b ON b.hour >= d.expired_through AND b.hour < d.horizon GROUP BY d.period, b.file_id"
+    "), decremented AS ("
+    "UPDATE file_rankings r SET downloads = r.downloads - e.n FROM expired e "
+    "WHERE r.period = e.period AND r.file_id = e.file_id AND r.downloads > e.n"
+    "), dropped AS ("
+    "DELETE FROM file_rankings r USING expired e "
+    "WHERE r.period = e.period AND r.file_id = e.file_id AND r.downloads <= e.n"
+    "), pruned AS ("
+    "DELETE FROM download_buckets WHERE hour < ("
+    "SELECT MIN(COALESCE(d.horizon, w.expired_through)) FROM ranking_windows w "
+    "LEFT JOIN due d ON d.period = w.period WHERE w.span IS NOT NULL)"
+    "), bumped AS ("
+    "UPDATE catalogue_version SET version = version + 1 WHERE id AND EXISTS (SELECT 1 FROM due)"
+    ") "
+    "UPDATE ranking_windows w SET expired_through = d.horizon FROM due d WHERE w.period = d.period"
+)
+
+# (file_url, sha256, crc32) of a file, the checksums are None for files uploaded without content
+FileDownload = Tuple[str, Optional[str], Optional[int]]
+
+_file_downloads: 'OrderedDict[int, FileDownload]' = OrderedDict()
+_lock = threading.Lock()
+_last_flush = float('-inf')
+
+
+def cached_file_download(file_id: int) -> Optional[FileDownload]:
+    with _lock:
+        if file_id in _file_downloads:
+            _file_downloads.move_to_end(file_id)
+            return _file_downloads[file_id]
+    return None
+
+
+def remember_file_download(file_id: int, download: FileDownload) -> None:
+    with _lock:
+        _file_downloads[file_id] = download
+        if len(_file_downloads) > FILE_DOWNLOAD_CACHE_SIZE:
+            _file_downloads.popitem(last=False)
+
+
+def get_file_download(cur: Any, file_id: int) -> Optional[FileDownload]:
+    '''URL and checksums of the file, served from an in-process LRU before hitting the DB'''
+    download = cached_file_download(file_id)
+    if download is not None:
+        return download
+
+    execute_prepared(cur, SELECT_FILE_DOWNLOAD, (file_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    remember_file_download(file_id, tuple(row))
+    return tuple(row)
+
+
+def format_crc32(crc32: Optional[int]) -> Optional[str]:
+    return None if crc32 is None else f'{crc32:08x}'
+
+
+def download_body(download: FileDownload) -> Dict[str, Any]:
+    '''Response of a download action, the checksums let clients skip files they already have'''
+    file_url, sha256, crc32 = download
+    return {'file_url': file_url, 'sha256': sha256, 'crc32': format_crc32(crc32)}
+
+
+def record_download(cur: Any, file_id: int) -> None:
+    execute_prepared(cur, INSERT_DOWNLOAD_EVENT, (file_id,))
+
+
+def flush_download_events(cur: Any, limit: int = DOWNLOAD_FLUSH_BATCH) -> int:
+    '''
+    Move up to limit pending events into files.downloads_count and the
+    rankings, then slide the ranking windows. Concurrent flushers skip each
+    other's rows, returns the number of files updated.
+    '''
+    execute_prepared(cur, FLUSH_DOWNLOAD_EVENTS, (limit,))
+    updated = cur.rowcount
+    execute_prepared(cur, EXPIRE_RANKINGS)
+    return updated
+
+
+def flush_due() -> bool:
+    '''True at most once per DOWNLOAD_FLUSH_INTERVAL for this process'''
+    global _last_flush
+    with _lock:
+        now = time.monotonic()
+        if now - _last_flush < DOWNLOAD_FLUSH_INTERVAL:
+            return False
+        _last_flush = now
+        return True
@@ -0,0 +1,63 @@
+'''
+NDJSON export of the whole catalogue for admin and backup jobs.
+
+Rows are read through a server-side (named) cursor that fetches
+EXPORT_ITERSIZE rows per round trip, and every line is serialised by
+Postgres, so memory use depends on the chunk size only and not on the
+size of the catalogue. Export is keyset-paginated by file id: a chunk
+stops once it reaches EXPORT_CHUNK_BYTES and reports the last id it
+contains, the next request resumes with after_id set to that id.
+
+Configuration (environment):
+    EXPORT_ITERSIZE      - rows fetched per server-side cursor round trip, default 2000
+    EXPORT_CHUNK_BYTES   - upper bound of one response body, default 4 MiB
+'''
+import itertools
+import os
+from typing import Any, Iterator, Optional, Tuple
+
+EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', '2000'))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', str(4 * 1024 * 1024)))
+
+_cursor_names = itertools.count()
+
+
+def iter_export_lines(conn: Any, after_id: int = 0) -> Iterator[Tuple[int, str]]:
+    '''(file id, NDJSON line) for every file with id above after_id, in id order'''
+    cur = conn.cursor(name=f'files_export_{next(_cursor_names)}')
+    cur.itersize = EXPORT_ITERSIZE
+    try:
+        cur.execute(
+            "SELECT f.id, json_build_object("
+            "'id', f.id, 'filename', f.filename, 'file_url', f.file_url, 'file_size', f.file_size, "
+            "'mime_type', f.mime_type, 'downloads_count', f.downloads_count, 'created_at', f.created_at, "
+            "'blob_sha256', f.blob_sha256, 'uploader_id', u.id, 'uploader_email', u.email, "
+            "'uploader_type', u.user_type, 'uploader_verified', u.is_verified, "
+            "'preview_url', f.preview_url, 'preview_mime_type', f.preview_mime_type)::text "
+            "FROM files f JOIN users u ON f.user_id = u.id WHERE f.id > %s ORDER BY f.id",
+            (after_id,)
+        )
+        for file_id, line in cur:
+            yield file_id, line + '\n'
+    finally:
+        cur.close()
+
+
+def export_chunk(conn: Any, after_id: int = 0, max_bytes: int = EXPORT_CHUNK_BYTES) -> Tuple[str, Optional[int]]:
+    '''
+    NDJSON body of at most max_bytes (or a single longer line) and the id to
+    resume from, None once the export is complete
+    '''
+    lines = []
+    size = 0
+    last_id = None
+
+    for file_id, line in iter_export_lines(conn, after_id):
+        line_size = len(line.encode())
+        if lines and size + line_size > max_bytes:
+            return ''.join(lines), last_id
+        lines.append(line)
+        size += line_size
+        last_id = file_id
+
+    return ''.join(lines), None
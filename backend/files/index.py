@@ -1,10 +1,387 @@
 import json
+import base64
 import os
-from typing import Dict, Any
+from datetime import datetime
+from urllib.parse import quote
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
+from cache import TTLCache
+from db import connection, execute_prepared, prepare, prewarm
+from downloads import download_body, flush_download_events, flush_due, format_crc32, get_file_download, record_download
+from export import export_chunk
+from instrumentation import instrumented, phase
+from quotas import check_quota
+from response import METHOD_NOT_ALLOWED, dumps, json_response, preflight_response, raw_json_response
+from storage import get_storage
+from tokens import is_admin_request, token_from_event, verify_token
+from validation import batch_item_error
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 500
+SEARCH_MODES = ('substring', 'fulltext')
+TOP_PERIODS = ('24h', '7d', 'all')
+MIN_SUBSTRING_LENGTH = 3
+SEARCH_MAX_UPLOADERS = int(os.environ.get('SEARCH_MAX_UPLOADERS', '20'))
+DOWNLOAD_MAX_BYTES = int(os.environ.get('DOWNLOAD_MAX_BYTES', str(4 * 1024 * 1024)))
+FILE_COLUMNS = (
+    "f.id, f.filename, f.file_url, f.file_size, f.mime_type, f.downloads_count, f.created_at, "
+    "u.email AS uploader_email, u.user_type AS uploader_type, u.id AS uploader_id, u.is_verified AS uploader_verified, "
+    "f.preview_url, f.preview_mime_type"
+)
+FILE_JSON_FIELDS = (
+    "'id', id, 'filename', filename, 'file_url', file_url, 'file_size', file_size, "
+    "'mime_type', mime_type, 'downloads_count', downloads_count, 'created_at', created_at, "
+    "'uploader_email', uploader_email, 'uploader_type', uploader_type, 'uploader_id', uploader_id, "
+    "'uploader_verified', uploader_verified, 'preview_url', preview_url, 'preview_mime_type', preview_mime_type"
+)
+FILE_JSON = f"json_build_object({FILE_JSON_FIELDS})"
+
+page_cache = TTLCache(
+    maxsize=int(os.environ.get('PAGE_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('PAGE_CACHE_TTL', '300'))
+)
+
+SELECT_CATALOGUE_VERSION = prepare('select_catalogue_version', "SELECT version FROM catalogue_version")
+SELECT_FILE_CONTENT = prepare(
+    'select_file_content',
+    "SELECT f.file_url, f.filename, f.mime_type, f.blob_sha256, f.crc32, b.storage_key "
+    "FROM files f LEFT JOIN blobs b ON b.sha256 = f.blob_sha256 WHERE f.id = $1"
+)
+
+PREFLIGHT = preflight_response(
+    'GET, HEAD, POST, OPTIONS',
+    'Content-Type, X-User-Id, X-Auth-Token, X-Admin-Key, If-None-Match, Range, If-Range'
+)
+
+
+def encode_cursor(sort_key: Any, file_id: int) -> str:
+    '''Opaque keyset cursor pointing at the last row of a page'''
+    if isinstance(sort_key, datetime):
+        sort_key = sort_key.isoformat()
+    raw = json.dumps([sort_key, file_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, parse_key: Callable[[Any], Any] = datetime.fromisoformat) -> Tuple[Any, int]:
+    '''Reverse of encode_cursor, raises ValueError on malformed input'''
+    try:
+        sort_key, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse_key(sort_key), int(file_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_header(event: Dict[str, Any], name: str) -> str:
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value or ''
+    return ''
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Inclusive (start, end) of the first range in a bytes Range header. None
+    when the header is absent or malformed and must be ignored, ValueError
+    when the range cannot be satisfied for an object of size bytes.
+    '''
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    start_text, _, end_text = (text.strip() for text in spec.split(',')[0].partition('-'))
+    if not (start_text or end_text) or not all(text.isdigit() for text in (start_text, end_text) if text):
+        return None
+    
+    if not start_text:
+        suffix = int(end_text)
+        if suffix == 0 or size == 0:
+            raise ValueError('unsatisfiable range')
+        return max(size - suffix, 0), size - 1
+    
+    start = int(start_text)
+    if end_text and int(end_text) < start:
+        return None
+    if start >= size:
+        raise ValueError('unsatisfiable range')
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    return start, end
+
+
+def filter_conditions(uploader_id: Optional[int], mime_type: Optional[str],
+                      min_size: Optional[int], max_size: Optional[int]) -> Tuple[List[str], List[Any]]:
+    conditions = []
+    args = []
+    
+    if uploader_id is not None:
+        conditions.append("f.user_id = %s")
+        args.append(uploader_id)
+    
+    if mime_type:
+        conditions.append("f.mime_type LIKE %s")
+        args.append(escape_like(mime_type) + '%')
+    
+    if min_size is not None:
+        conditions.append("f.file_size >= %s")
+        args.append(min_size)
+    
+    if max_size is not None:
+        conditions.append("f.file_size <= %s")
+        args.append(max_size)
+    
+    return conditions, args
+
+
+def file_row(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    '''API representation of a row selected with FILE_COLUMNS'''
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'file_url': row[2],
+        'file_size': row[3],
+        'mime_type': row[4],
+        'downloads_count': row[5],
+        'created_at': row[6].isoformat() if row[6] else None,
+        'uploader_email': row[7],
+        'uploader_type': row[8],
+        'uploader_id': row[9],
+        'uploader_verified': row[10],
+        'preview_url': row[11],
+        'preview_mime_type': row[12]
+    }
+
+
+def list_files_query(limit: int, cursor: Optional[Tuple[datetime, int]], uploader_id: Optional[int],
+                     mime_type: Optional[str], min_size: Optional[int], max_size: Optional[int]) -> Tuple[str, List[Any]]:
+    '''
+    SQL and arguments of one keyset page of the catalogue, newest first.
+    Rows are serialised by Postgres with json_agg so the page arrives as a
+    single text value and never becomes per-row Python objects.
+    '''
+    conditions, args = filter_conditions(uploader_id, mime_type, min_size, max_size)
+    
+    if cursor:
+        conditions.append("(f.created_at, f.id) < (%s::timestamp, %s)")
+        args.extend(cursor)
+    
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    args.append(limit + 1)
+    
+    return (
+        "WITH page AS ("
+        f"SELECT {FILE_COLUMNS}, row_number() OVER (ORDER BY f.created_at DESC, f.id DESC) AS n "
+        "FROM files f JOIN users u ON f.user_id = u.id "
+        + where
+        + "ORDER BY f.created_at DESC, f.id DESC LIMIT %s) "
+        f"SELECT COALESCE(json_agg({FILE_JSON} ORDER BY n) FILTER (WHERE n <= %s), '[]')::text, "
+        "COUNT(*) > %s, MAX(created_at) FILTER (WHERE n = %s), MAX(id) FILTER (WHERE n = %s) FROM page",
+        args + [limit] * 4
+    )
+
+
+def top_files_query(period: str, limit: int, cursor: Optional[Tuple[int, int]], uploader_id: Optional[int],
+                    mime_type: Optional[str], min_size: Optional[int], max_size: Optional[int]) -> Tuple[str, List[Any]]:
+    '''
+    SQL and arguments of one keyset page of the most downloaded files in
+    period, overall or of one uploader. Pages walk the precomputed
+    file_rankings index and never sort the files table; each file carries
+    window_downloads, its downloads within the period.
+    '''
+    conditions, args = filter_conditions(None, mime_type, min_size, max_size)
+    conditions.insert(0, "r.period = %s")
+    args.insert(0, period)
+    
+    if uploader_id is not None:
+        conditions.append("r.uploader_id = %s")
+        args.append(uploader_id)
+    
+    if cursor:
+        conditions.append("(r.downloads, r.file_id) < (%s, %s)")
+        args.extend(cursor)
+    
+    args.append(limit + 1)
+    
+    return (
+        "WITH page AS ("
+        f"SELECT {FILE_COLUMNS}, r.downloads AS window_downloads, "
+        "row_number() OVER (ORDER BY r.downloads DESC, r.file_id DESC) AS n "
+        "FROM file_rankings r JOIN files f ON f.id = r.file_id JOIN users u ON f.user_id = u.id "
+        f"WHERE {' AND '.join(conditions)} "
+        "ORDER BY r.downloads DESC, r.file_id DESC LIMIT %s) "
+        f"SELECT COALESCE(json_agg(json_build_object({FILE_JSON_FIELDS}, 'window_downloads', window_downloads) "
+        "ORDER BY n) FILTER (WHERE n <= %s), '[]')::text, "
+        "COUNT(*) > %s, MAX(window_downloads) FILTER (WHERE n = %s), MAX(id) FILTER (WHERE n = %s) FROM page",
+        args + [limit] * 4
+    )
+
+
+def top_files(cur: Any, period: str, limit: int, cursor: Optional[Tuple[int, int]], uploader_id: Optional[int],
+              mime_type: Optional[str], min_size: Optional[int], max_size: Optional[int]) -> str:
+    '''One page of the period's leaderboard, most downloaded first, as an encoded JSON body'''
+    cur.execute(*top_files_query(period, limit, cursor, uploader_id, mime_type, min_size, max_size))
+    return list_files_body(cur.fetchone())
+
+
+def list_files_body(row: Tuple[Any, ...]) -> str:
+    '''Encoded JSON page from the single row returned by list_files_query or top_files_query'''
+    files_json, has_more, last_created_at, last_id = row
+    next_cursor = encode_cursor(last_created_at, last_id) if has_more else None
+    
+    with phase('json_encode'):
+        return f'{{"files":{files_json},"next_cursor":{dumps(next_cursor)}}}'
+
+
+def list_files(cur: Any, limit: int, cursor: Optional[Tuple[datetime, int]], uploader_id: Optional[int],
+               mime_type: Optional[str], min_size: Optional[int], max_size: Optional[int]) -> str:
+    '''One keyset page of the catalogue, newest first, as an encoded JSON body'''
+    cur.execute(*list_files_query(limit, cursor, uploader_id, mime_type, min_size, max_size))
+    return list_files_body(cur.fetchone())
+
+
+def search_files_query(query: str, mode: str, limit: int, cursor: Optional[Tuple[float, int]],
+                       uploader_id: Optional[int], mime_type: Optional[str],
+                       min_size: Optional[int], max_size: Optional[int]) -> Tuple[str, List[Any]]:
+    '''
+    SQL and arguments of one search_files page. Files match by filename or
+    through the SEARCH_MAX_UPLOADERS users whose email matches best. Each
+    branch returns only its own top limit + 1 rows past the cursor, so a
+    common term costs one bounded top-N per branch instead of ranking every
+    match. Both branches compute the same score, the better of the filename
+    and uploader match, which keeps keyset pages exact.
+    '''
+    if mode == 'fulltext':
+        uploaders = (
+            "SELECT id, ts_rank(search_vector, q) AS score FROM users, websearch_to_tsquery('simple', %s) q "
+            "WHERE search_vector @@ q ORDER BY score DESC, id LIMIT %s"
+        )
+        uploader_args: List[Any] = [query, SEARCH_MAX_UPLOADERS]
+        query_source, source_args = ", websearch_to_tsquery('simple', %s) q", [query]
+        filename_score = "CASE WHEN f.search_vector @@ q THEN ts_rank(f.search_vector, q) END"
+        filename_match, score_args, match_args = "f.search_vector @@ q", [], []
+    else:
+        pattern = '%' + escape_like(query) + '%'
+        uploaders = "SELECT id, similarity(email, %s) AS score FROM users WHERE email ILIKE %s ORDER BY score DESC, id LIMIT %s"
+        uploader_args = [query, pattern, SEARCH_MAX_UPLOADERS]
+        query_source, source_args = "", []
+        filename_score = "CASE WHEN f.filename ILIKE %s THEN similarity(f.filename, %s) END"
+        filename_match, score_args, match_args = "f.filename ILIKE %s", [pattern, query], [pattern]
+    
+    conditions, filter_args = filter_conditions(uploader_id, mime_type, min_size, max_size)
+    outer = "WHERE (score, id) < (%s, %s) " if cursor else ""
+    outer_args = list(cursor or ()) + [limit + 1]
+    
+    def branch(join: str, match: Optional[str], branch_match_args: List[Any]) -> Tuple[str, List[Any]]:
+        where = ' AND '.join(([match] if match else []) + conditions)
+        return (
+            f"(SELECT id, score FROM (SELECT f.id, GREATEST({filename_score}, m.score)::float8 AS score "
+            f"FROM files f {join} m ON m.id = f.user_id{query_source}{' WHERE ' + where if where else ''}) b "
+            f"{outer}ORDER BY score DESC, id DESC LIMIT %s)",
+            score_args + source_args + branch_match_args + filter_args + outer_args
+        )
+    
+    by_filename, by_filename_args = branch('LEFT JOIN', filename_match, match_args)
+    by_uploader, by_uploader_args = branch('JOIN', None, [])
+    
+    return (
+        f"WITH m AS ({uploaders}), r AS ({by_filename} UNION {by_uploader}) "
+        f"SELECT {FILE_COLUMNS}, r.score FROM r JOIN files f ON f.id = r.id JOIN users u ON f.user_id = u.id "
+        "ORDER BY r.score DESC, f.id DESC LIMIT %s",
+        uploader_args + by_filename_args + by_uploader_args + [limit + 1]
+    )
+
+
+def search_files_page(rows: List[Tuple[Any, ...]], limit: int) -> Dict[str, Any]:
+    '''Page of search results from the rows returned by search_files_query'''
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][13], rows[-1][0])
+    
+    files = []
+    for row in rows:
+        files.append(dict(file_row(row), score=round(row[13], 4)))
+    
+    return {'files': files, 'next_cursor': next_cursor}
+
+
+def search_files(cur: Any, query: str, mode: str, limit: int, cursor: Optional[Tuple[float, int]],
+                 uploader_id: Optional[int], mime_type: Optional[str],
+                 min_size: Optional[int], max_size: Optional[int]) -> Dict[str, Any]:
+    '''
+    One page of files whose name or uploader email match query, best match first.
+    "substring" ranks trigram similarity of ILIKE matches, "fulltext" ranks
+    websearch-style queries against the generated tsvector columns.
+    '''
+    cur.execute(*search_files_query(query, mode, limit, cursor, uploader_id, mime_type, min_size, max_size))
+    return search_files_page(cur.fetchall(), limit)
+
+
+def parse_listing(params: Dict[str, Any]) -> Tuple[Any, ...]:
+    '''
+    (search, mode, limit, cursor, uploader_id, mime_type, min_size, max_size, period)
+    of a listing request, raises ValueError or TypeError on invalid input.
+    mode is a search mode with search, otherwise "top" or "latest", period
+    is set for "top" only.
+    '''
+    search = (params.get('search') or '').strip()
+    mode = params.get('mode') or 'substring'
+    period = None
+    
+    if search and (mode not in SEARCH_MODES or mode == 'substring' and len(search) < MIN_SUBSTRING_LENGTH):
+        raise ValueError('invalid search')
+    
+    if not search:
+        mode = 'top' if mode == 'top' else 'latest'
+    
+    if mode == 'top':
+        period = params.get('period') or 'all'
+        if period not in TOP_PERIODS:
+            raise ValueError('invalid period')
+    
+    limit = min(max(int(params.get('limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    parse_key = float if search else int if mode == 'top' else datetime.fromisoformat
+    cursor = decode_cursor(params['cursor'], parse_key) if params.get('cursor') else None
+    uploader_id = int(params['uploader_id']) if params.get('uploader_id') else None
+    min_size = int(params['min_size']) if params.get('min_size') else None
+    max_size = int(params['max_size']) if params.get('max_size') else None
+    
+    return search, mode, limit, cursor, uploader_id, params.get('mime_type'), min_size, max_size, period
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    return etag in [tag.strip() for tag in get_header(event, 'If-None-Match').split(',')]
+
+
+def not_modified(etag: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+
+def listing_response(etag: str, body: str) -> Dict[str, Any]:
+    return raw_json_response(200, body, {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'Access-Control-Expose-Headers': 'ETag'
+    })
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: File management - upload metadata, list files, track downloads
+    Business: File management - upload metadata, list, search and rank files by downloads, track downloads, serve file content with Range, NDJSON export for admins
     Args: event - dict with httpMethod, body, queryStringParameters, headers
           context - object with request_id attribute
     Returns: HTTP response dict with file data
@@ -12,145 +389,309 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    import psycopg2
-    
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor()
-    
-    if method == 'GET':
-        cur.execute(
-            "SELECT f.id, f.filename, f.file_url, f.file_size, f.mime_type, f.downloads_count, f.created_at, u.email, u.user_type, u.id, u.is_verified FROM files f JOIN users u ON f.user_id = u.id ORDER BY f.created_at DESC"
-        )
-        
-        files = []
-        for row in cur.fetchall():
-            files.append({
-                'id': row[0],
-                'filename': row[1],
-                'file_url': row[2],
-                'file_size': row[3],
-                'mime_type': row[4],
-                'downloads_count': row[5],
-                'created_at': row[6].isoformat() if row[6] else None,
-                'uploader_email': row[7],
-                'uploader_type': row[8],
-                'uploader_id': row[9],
-                'uploader_verified': row[10]
-            })
-        
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'files': files})
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
+        return PREFLIGHT
+    
+    with connection() as conn:
+        cur = conn.cursor()
         
-        if action == 'upload':
-            user_id = body_data.get('user_id')
-            filename = body_data.get('filename')
-            file_url = body_data.get('file_url')
-            file_size = body_data.get('file_size', 0)
-            mime_type = body_data.get('mime_type', 'application/octet-stream')
+        if method in ('GET', 'HEAD'):
+            params = event.get('queryStringParameters', {}) or {}
+            
+            if params.get('download'):
+                try:
+                    file_id = int(params['download'])
+                except ValueError:
+                    return json_response(400, {'error': 'Некорректные параметры запроса'})
+                
+                execute_prepared(cur, SELECT_FILE_CONTENT, (file_id,))
+                row = cur.fetchone()
+                
+                if not row:
+                    return json_response(404, {'error': 'Файл не найден'})
+                
+                file_url, filename, mime_type, sha256, crc32, storage_key = row
+                storage = get_storage()
+                size = storage.size(storage_key) if storage_key else None
+                
+                if size is None:
+                    return {
+                        'statusCode': 302,
+                        'headers': {'Location': file_url, 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': ''
+                    }
+                
+                etag = f'"{sha256}"'
+                
+                # The ETag is the content digest, a client holding the same content skips the transfer
+                if etag_matches(event, etag):
+                    return not_modified(etag)
+                
+                headers = {
+                    'Content-Type': mime_type or 'application/octet-stream',
+                    'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename or str(file_id))}",
+                    'Accept-Ranges': 'bytes',
+                    'ETag': etag,
+                    'Repr-Digest': f'sha-256=:{base64.b64encode(bytes.fromhex(sha256)).decode()}:',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers':
+                        'Accept-Ranges, Content-Range, Content-Length, ETag, Repr-Digest, X-Checksum-CRC32'
+                }
+                
+                if crc32 is not None:
+                    headers['X-Checksum-CRC32'] = format_crc32(crc32)
+                
+                range_header = get_header(event, 'Range')
+                if_range = get_header(event, 'If-Range').strip()
+                
+                if if_range and if_range != etag:
+                    range_header = ''
+                
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    headers['Content-Range'] = f'bytes */{size}'
+                    return {'statusCode': 416, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+                
+                if method == 'HEAD':
+                    headers['Content-Length'] = str(size)
+                    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+                
+                if byte_range is None:
+                    if size > DOWNLOAD_MAX_BYTES:
+                        return json_response(413, {
+                            'error': 'Файл слишком большой, скачивайте его частями с заголовком Range',
+                            'file_size': size,
+                            'max_range': DOWNLOAD_MAX_BYTES
+                        }, {'Accept-Ranges': 'bytes'})
+                    status, start, end = 200, 0, size - 1
+                else:
+                    start, end = byte_range
+                    end = min(end, start + DOWNLOAD_MAX_BYTES - 1)
+                    status = 206
+                    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+                
+                content = storage.read_range(storage_key, start, end - start + 1) if size else b''
+                headers['Content-Length'] = str(len(content))
+                
+                if start == 0:
+                    record_download(cur, file_id)
+                    conn.commit()
+                    
+                    if flush_due():
+                        flush_download_events(cur)
+                        conn.commit()
+                
+                return {
+                    'statusCode': status,
+                    'headers': headers,
+                    'isBase64Encoded': True,
+                    'body': base64.b64encode(content).decode()
+                }
             
-            cur.execute(
-                "SELECT user_type FROM users WHERE id = %s",
-                (user_id,)
-            )
-            user = cur.fetchone()
+            if method == 'HEAD':
+                return METHOD_NOT_ALLOWED
             
-            if not user or user[0] != 'special':
-                conn.close()
+            if params.get('export'):
+                if not is_admin_request(event):
+                    return json_response(403, {'error': 'Экспорт доступен только администраторам'})
+                
+                try:
+                    if params['export'] != 'ndjson':
+                        raise ValueError('unsupported export format')
+                    after_id = int(params.get('after_id') or 0)
+                except ValueError:
+                    return json_response(400, {'error': 'Некорректные параметры запроса'})
+                
+                with phase('export'):
+                    body, next_after_id = export_chunk(conn, after_id)
+                
+                headers = {
+                    'Content-Type': 'application/x-ndjson',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'X-Export-Next-After-Id'
+                }
+                
+                if next_after_id is not None:
+                    headers['X-Export-Next-After-Id'] = str(next_after_id)
+                
                 return {
-                    'statusCode': 403,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
+                    'statusCode': 200,
+                    'headers': headers,
                     'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Только особые пользователи могут загружать файлы'})
+                    'body': body
                 }
             
-            cur.execute(
-                "INSERT INTO files (user_id, filename, file_url, file_size, mime_type) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (user_id, filename, file_url, file_size, mime_type)
-            )
+            try:
+                listing = parse_listing(params)
+            except (ValueError, TypeError):
+                return json_response(400, {'error': 'Некорректные параметры запроса'})
             
-            file_id = cur.fetchone()[0]
-            conn.commit()
-            conn.close()
+            if listing[1] == 'top' and flush_due():
+                # Rankings only move on flush, so keep them fresh while nobody downloads
+                flush_download_events(cur)
+                conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'file_id': file_id, 'message': 'Файл загружен успешно'})
-            }
-        
-        elif action == 'download':
-            file_id = body_data.get('file_id')
+            execute_prepared(cur, SELECT_CATALOGUE_VERSION)
+            etag = f'"{cur.fetchone()[0]}"'
             
-            cur.execute(
-                "UPDATE files SET downloads_count = downloads_count + 1 WHERE id = %s RETURNING file_url",
-                (file_id,)
-            )
+            if etag_matches(event, etag):
+                return not_modified(etag)
             
-            result = cur.fetchone()
-            conn.commit()
-            conn.close()
+            page_key = (etag,) + listing
+            body = page_cache.get(page_key)
             
-            if not result:
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Файл не найден'})
-                }
+            if body is None:
+                if listing[0]:
+                    page = search_files(cur, *listing[:8])
+                    
+                    with phase('json_encode'):
+                        body = dumps(page)
+                elif listing[1] == 'top':
+                    body = top_files(cur, listing[8], *listing[2:8])
+                else:
+                    body = list_files(cur, *listing[2:8])
+                
+                page_cache.set(page_key, body)
+            
+            return listing_response(etag, body)
+        
+        elif method == 'POST':
+            with phase('json_decode'):
+                body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'file_url': result[0]})
-            }
-    
-    conn.close()
+            if action in ('upload', 'upload_batch'):
+                user_id = body_data.get('user_id')
+                filename = body_data.get('filename')
+                file_url = body_data.get('file_url')
+                file_size = body_data.get('file_size', 0)
+                mime_type = body_data.get('mime_type', 'application/octet-stream')
+                
+                token = token_from_event(event)
+                
+                if token:
+                    claims = verify_token(token)
+                    
+                    if not claims:
+                        return json_response(401, {'error': 'Недействительный токен'})
+                    
+                    user_id = claims['user_id']
+                    user_type = claims['user_type']
+                else:
+                    cur.execute(
+                        "SELECT user_type FROM users WHERE id = %s",
+                        (user_id,)
+                    )
+                    user = cur.fetchone()
+                    user_type = user[0] if user else None
+                
+                if user_type != 'special':
+                    return json_response(403, {'error': 'Только особые пользователи могут загружать файлы'})
+                
+                if action == 'upload_batch':
+                    items = body_data.get('files')
+                    
+                    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+                        return json_response(400, {'error': f'Передайте от 1 до {MAX_BATCH_SIZE} файлов'})
+                    
+                    results = [{'index': index} for index in range(len(items))]
+                    rows = []
+                    accepted = []
+                    
+                    for index, item in enumerate(items):
+                        error = batch_item_error(item, 'file_url')
+                        
+                        if error:
+                            results[index]['error'] = error
+                        else:
+                            rows.append((
+                                user_id,
+                                item['filename'],
+                                item['file_url'],
+                                int(item.get('file_size') or 0),
+                                item.get('mime_type') or 'application/octet-stream'
+                            ))
+                            accepted.append(index)
+                    
+                    if rows:
+                        from psycopg2.extras import execute_values
+                        
+                        over_quota = check_quota(cur, user_id, sum(row[3] for row in rows), len(rows))
+                        
+                        if over_quota:
+                            return over_quota
+                        
+                        file_ids = execute_values(
+                            cur,
+                            "INSERT INTO files (user_id, filename, file_url, file_size, mime_type) VALUES %s RETURNING id",
+                            rows,
+                            page_size=len(rows),
+                            fetch=True
+                        )
+                        over_quota = check_quota(cur, user_id)
+                        
+                        if over_quota:
+                            conn.rollback()
+                            return over_quota
+                        
+                        conn.commit()
+                        
+                        for index, (file_id,) in zip(accepted, file_ids):
+                            results[index]['file_id'] = file_id
+                    
+                    return json_response(200, {
+                        'results': results,
+                        'uploaded': len(rows),
+                        'failed': len(items) - len(rows)
+                    })
+                
+                try:
+                    file_size = int(file_size or 0)
+                    if file_size < 0:
+                        raise ValueError('negative file size')
+                except (TypeError, ValueError):
+                    return json_response(400, {'error': 'Некорректный размер файла'})
+                
+                over_quota = check_quota(cur, user_id, file_size, 1)
+                
+                if over_quota:
+                    return over_quota
+                
+                cur.execute(
+                    "INSERT INTO files (user_id, filename, file_url, file_size, mime_type) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                    (user_id, filename, file_url, file_size, mime_type)
+                )
+                
+                file_id = cur.fetchone()[0]
+                over_quota = check_quota(cur, user_id)
+                
+                if over_quota:
+                    conn.rollback()
+                    return over_quota
+                
+                conn.commit()
+                
+                return json_response(200, {'file_id': file_id, 'message': 'Файл загружен успешно'})
+            
+            elif action == 'download':
+                file_id = body_data.get('file_id')
+                
+                download = get_file_download(cur, file_id)
+                
+                if not download:
+                    return json_response(404, {'error': 'Файл не найден'})
+                
+                record_download(cur, file_id)
+                conn.commit()
+                
+                if flush_due():
+                    flush_download_events(cur)
+                    conn.commit()
+                
+                return json_response(200, download_body(download))
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    return METHOD_NOT_ALLOWED
+
+
+prewarm()
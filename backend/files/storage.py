@@ -0,0 +1,191 @@
+'''
+Pluggable object storage for uploaded files.
+
+Objects are addressed by a slash separated key and always written and read
+as streams of byte chunks, so callers never need to hold a whole file in
+memory. Byte ranges can be read without touching the rest of the object,
+and concat() joins stored objects inside the backend; the local backend
+does both with positional reads and os.sendfile, so the bytes never pass
+through Python buffers. The backend is chosen once per process from the
+environment:
+
+    STORAGE_BACKEND     - name registered in BACKENDS, default "local"
+    STORAGE_ROOT        - directory used by the local backend
+    STORAGE_PUBLIC_URL  - base of the public URLs handed out to clients
+'''
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from itertools import chain
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Type
+
+READ_BLOCK_SIZE = 1024 * 1024
+PUBLIC_URL = os.environ.get('STORAGE_PUBLIC_URL', 'https://storage.vnefiles.cloud').rstrip('/')
+
+
+class Storage:
+    '''Interface every storage backend implements'''
+
+    def write(self, key: str, chunks: Iterable[bytes]) -> int:
+        '''Store the concatenation of chunks under key, return bytes written'''
+        raise NotImplementedError
+
+    def read(self, key: str) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        '''Up to length bytes of the object starting at offset start'''
+        raise NotImplementedError
+
+    def concat(self, key: str, parts: List[str]) -> int:
+        '''Store the concatenation of the objects under parts as key, return its size'''
+        return self.write(key, chain.from_iterable(self.read(part) for part in parts))
+
+    def size(self, key: str) -> Optional[int]:
+        '''Object size in bytes or None when the key does not exist'''
+        raise NotImplementedError
+
+    def list(self, prefix: str) -> List[str]:
+        '''Keys directly under prefix, sorted'''
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        return f"{PUBLIC_URL}/{key}"
+
+
+class LocalStorage(Storage):
+    '''Filesystem backend, objects are plain files below root'''
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, key))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise ValueError(f'key outside of storage root: {key}')
+        return path
+
+    @contextmanager
+    def _replacing(self, key: str) -> Iterator[IO[bytes]]:
+        '''
+        File that replaces the object once the block completes. Every writer
+        gets its own temporary file, so concurrent writers of one key (a
+        retried chunk, two uploads of the same new content) never collide.
+        '''
+        path = self._path(key)
+        directory, name = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.partial', dir=directory)
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write(self, key: str, chunks: Iterable[bytes]) -> int:
+        written = 0
+        with self._replacing(key) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def read(self, key: str) -> Iterator[bytes]:
+        with open(self._path(key), 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK_SIZE)
+                if not block:
+                    return
+                yield block
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        fd = os.open(self._path(key), os.O_RDONLY)
+        try:
+            return os.pread(fd, length, start)
+        finally:
+            os.close(fd)
+
+    def concat(self, key: str, parts: List[str]) -> int:
+        if not hasattr(os, 'sendfile'):
+            return super().concat(key, parts)
+        written = 0
+        with self._replacing(key) as out:
+            for part in parts:
+                with open(self._path(part), 'rb') as src:
+                    written += _sendfile(out, src)
+        return written
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix: str) -> List[str]:
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            f"{prefix.rstrip('/')}/{name}"
+            for name in os.listdir(directory)
+            if not name.endswith('.partial')
+        )
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str) -> None:
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+
+def _sendfile(out, src) -> int:
+    '''Copy src to the end of out inside the kernel, falling back to a buffered copy'''
+    size = os.fstat(src.fileno()).st_size
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except OSError:
+        if offset:
+            raise
+        shutil.copyfileobj(src, out, READ_BLOCK_SIZE)
+        out.flush()
+        return size
+    return offset
+
+
+BACKENDS: Dict[str, Type[Storage]] = {
+    'local': LocalStorage,
+}
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    '''Return the process-wide storage backend configured by the environment'''
+    global _storage
+    if _storage is None:
+        backend = os.environ.get('STORAGE_BACKEND', 'local')
+        if backend == 'local':
+            root = os.environ.get('STORAGE_ROOT') or os.path.join(tempfile.gettempdir(), 'vnefiles-storage')
+            _storage = LocalStorage(root)
+        else:
+            _storage = BACKENDS[backend]()
+    return _storage
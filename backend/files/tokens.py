@@ -0,0 +1,105 @@
+'''
+Stateless HMAC-signed auth tokens.
+
+A token is "<payload>.<signature>", both base64url encoded, where payload is
+JSON with the user id, type, verification flag and issue/expiry times. Any
+function that shares AUTH_TOKEN_SECRET can verify it locally without a DB
+round trip. Because nothing is looked up, a token stays valid until it
+expires: revocation is configuration only. Listing a user in
+AUTH_REVOKED_USER_IDS rejects all of their tokens once the functions are
+redeployed with it, and changing AUTH_TOKEN_SECRET rejects every token
+issued so far.
+
+Configuration (environment):
+    AUTH_TOKEN_SECRET       - HMAC key, tokens are disabled when empty
+    AUTH_TOKEN_TTL          - lifetime in seconds, default 7 days
+    AUTH_REVOKED_USER_IDS   - comma separated ids whose tokens are never accepted
+    ADMIN_API_KEY           - key expected in X-Admin-Key for admin endpoints,
+                              admin endpoints are disabled when empty
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '').encode()
+TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', str(7 * 24 * 3600)))
+TOKEN_HEADER = 'X-Auth-Token'
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+ADMIN_KEY_HEADER = 'X-Admin-Key'
+REVOKED_USER_IDS = frozenset(
+    int(user_id) for user_id in os.environ.get('AUTH_REVOKED_USER_IDS', '').split(',') if user_id.strip()
+)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, user_type: str, is_verified: bool) -> Optional[str]:
+    '''Signed token for the user or None when no secret is configured'''
+    if not TOKEN_SECRET:
+        return None
+    now = int(time.time())
+    payload = _b64encode(json.dumps({
+        'uid': user_id,
+        'typ': user_type,
+        'ver': bool(is_verified),
+        'iat': now,
+        'exp': now + TOKEN_TTL
+    }, separators=(',', ':')).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    '''
+    Claims of a valid token as {'user_id', 'user_type', 'is_verified'},
+    None when the token is malformed, forged, expired or revoked
+    '''
+    if not TOKEN_SECRET or not token or token.count('.') != 1:
+        return None
+    payload, signature = token.split('.')
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+        user_id = int(claims['uid'])
+        expires_at = float(claims['exp'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if expires_at < time.time() or user_id in REVOKED_USER_IDS:
+        return None
+    return {
+        'user_id': user_id,
+        'user_type': claims.get('typ'),
+        'is_verified': bool(claims.get('ver'))
+    }
+
+
+def _header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def token_from_event(event: Dict[str, Any]) -> Optional[str]:
+    return _header(event, TOKEN_HEADER)
+
+
+def is_admin_request(event: Dict[str, Any]) -> bool:
+    '''True when the request carries the configured admin key'''
+    key = _header(event, ADMIN_KEY_HEADER) or ''
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(key.encode(), ADMIN_API_KEY.encode())
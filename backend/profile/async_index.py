@@ -0,0 +1,43 @@
+from typing import Dict, Any
+
+from adb import async_connection, fetchrow, run_sync
+from db import statement
+from index import PREFLIGHT, SELECT_PROFILE, handler, profile_cache, profile_from_row
+from instrumentation import instrumented
+from response import json_response
+
+
+@instrumented
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Async entry point of the profile function for self-hosting - profile reads on asyncpg,
+              updates run the sync handler in a thread
+    Args: event - dict with httpMethod, body, queryStringParameters
+          context - object with request_id attribute
+    Returns: HTTP response dict, the same as handler returns for the event
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return PREFLIGHT
+    
+    if method == 'GET':
+        params = event.get('queryStringParameters', {}) or {}
+        user_id = str(params.get('user_id') or '')
+        
+        if user_id.isdigit():
+            profile_data = profile_cache.get(user_id)
+            
+            if profile_data is None:
+                async with async_connection() as conn:
+                    user = await fetchrow(conn, statement(SELECT_PROFILE), int(user_id))
+                
+                if not user:
+                    return json_response(404, {'error': 'Пользователь не найден'})
+                
+                profile_data = profile_from_row(user)
+                profile_cache.set(user_id, profile_data)
+            
+            return json_response(200, profile_data)
+    
+    return await run_sync(handler.__wrapped__, event, context)
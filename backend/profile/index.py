@@ -1,7 +1,46 @@
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
+from cache import TTLCache
+from db import connection, execute_prepared, prepare, prewarm
+from instrumentation import instrumented, phase
+from response import METHOD_NOT_ALLOWED, json_response, preflight_response
+
+profile_cache = TTLCache(
+    maxsize=int(os.environ.get('PROFILE_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('PROFILE_CACHE_TTL', '10'))
+)
+
+SELECT_PROFILE = prepare(
+    'select_profile',
+    "SELECT u.id, u.email, u.user_type, u.is_verified, u.full_name, u.bio, u.avatar_url, u.created_at, "
+    "COALESCE(s.files_count, 0), COALESCE(s.total_downloads, 0) "
+    "FROM users u LEFT JOIN user_stats s ON s.user_id = u.id WHERE u.id = $1"
+)
+
+PREFLIGHT = preflight_response('GET, POST, OPTIONS', 'Content-Type, X-User-Id')
+
+
+def profile_from_row(user: Tuple[Any, ...]) -> Dict[str, Any]:
+    '''API representation of a row selected with SELECT_PROFILE'''
+    return {
+        'user_id': user[0],
+        'email': user[1],
+        'user_type': user[2],
+        'is_verified': user[3],
+        'full_name': user[4],
+        'bio': user[5],
+        'avatar_url': user[6],
+        'created_at': user[7].isoformat() if user[7] else None,
+        'stats': {
+            'files_count': user[8],
+            'total_downloads': user[9]
+        }
+    }
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: User profile management - view and update profiles
@@ -12,154 +51,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    import psycopg2
-    
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor()
+        return PREFLIGHT
     
     if method == 'GET':
         params = event.get('queryStringParameters', {}) or {}
         user_id = params.get('user_id')
         
         if not user_id:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'user_id обязателен'})
-            }
-        
-        cur.execute(
-            "SELECT id, email, user_type, is_verified, full_name, bio, avatar_url, created_at FROM users WHERE id = %s",
-            (user_id,)
-        )
+            return json_response(400, {'error': 'user_id обязателен'})
         
-        user = cur.fetchone()
+        profile_data = profile_cache.get(str(user_id))
         
-        if not user:
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Пользователь не найден'})
-            }
+        if profile_data is None:
+            with connection() as conn:
+                cur = conn.cursor()
+                execute_prepared(cur, SELECT_PROFILE, (user_id,))
+                user = cur.fetchone()
+            
+            if not user:
+                return json_response(404, {'error': 'Пользователь не найден'})
+            
+            profile_data = profile_from_row(user)
+            profile_cache.set(str(user_id), profile_data)
         
-        cur.execute(
-            "SELECT COUNT(*) FROM files WHERE user_id = %s",
-            (user_id,)
-        )
-        files_count = cur.fetchone()[0]
-        
-        cur.execute(
-            "SELECT COALESCE(SUM(downloads_count), 0) FROM files WHERE user_id = %s",
-            (user_id,)
-        )
-        total_downloads = cur.fetchone()[0]
-        
-        conn.close()
-        
-        profile_data = {
-            'user_id': user[0],
-            'email': user[1],
-            'user_type': user[2],
-            'is_verified': user[3],
-            'full_name': user[4],
-            'bio': user[5],
-            'avatar_url': user[6],
-            'created_at': user[7].isoformat() if user[7] else None,
-            'stats': {
-                'files_count': files_count,
-                'total_downloads': total_downloads
-            }
-        }
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps(profile_data)
-        }
+        return json_response(200, profile_data)
     
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
+    if method == 'POST':
+        with phase('json_decode'):
+            body_data = json.loads(event.get('body', '{}'))
         user_id = body_data.get('user_id')
         full_name = body_data.get('full_name')
         bio = body_data.get('bio')
         avatar_url = body_data.get('avatar_url')
         
         if not user_id:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'user_id обязателен'})
-            }
-        
-        cur.execute(
-            "UPDATE users SET full_name = %s, bio = %s, avatar_url = %s WHERE id = %s RETURNING id",
-            (full_name, bio, avatar_url, user_id)
-        )
+            return json_response(400, {'error': 'user_id обязателен'})
         
-        if cur.rowcount == 0:
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Пользователь не найден'})
-            }
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE users SET full_name = %s, bio = %s, avatar_url = %s WHERE id = %s RETURNING id",
+                (full_name, bio, avatar_url, user_id)
+            )
+            
+            if cur.rowcount == 0:
+                return json_response(404, {'error': 'Пользователь не найден'})
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        profile_cache.delete(str(user_id))
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({'message': 'Профиль обновлён'})
-        }
-    
-    conn.close()
+        return json_response(200, {'message': 'Профиль обновлён'})
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return METHOD_NOT_ALLOWED
+
+
+prewarm()
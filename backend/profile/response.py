@@ -0,0 +1,67 @@
+'''
+Response envelopes and JSON encoding shared by the handler.
+
+Header dicts are built once per process and shared by every response, so
+callers must treat them as read-only and pass extra headers explicitly.
+orjson is used for encoding when it is installed, otherwise the stdlib
+encoder produces the same compact UTF-8 output.
+'''
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS: Dict[str, str] = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default).decode()
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def raw_json_response(status: int, body: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''Response around an already encoded JSON body'''
+    return {
+        'statusCode': status,
+        'headers': JSON_HEADERS if headers is None else {**JSON_HEADERS, **headers},
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+
+def json_response(status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return raw_json_response(status, dumps(payload), headers)
+
+
+def preflight_response(methods: str, allow_headers: str) -> Dict[str, Any]:
+    '''CORS preflight answer, meant to be built once at import time'''
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': ''
+    }
+
+
+METHOD_NOT_ALLOWED = raw_json_response(405, dumps({'error': 'Method not allowed'}))
@@ -0,0 +1,20 @@
+from typing import Dict, Any
+
+from adb import run_sync
+from index import PREFLIGHT, handler
+from instrumentation import instrumented
+
+
+@instrumented
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Async entry point of the upload function for self-hosting - uploads are
+              CPU and storage bound, so every request runs the sync handler in a thread
+    Args: event - dict with httpMethod, body, queryStringParameters, headers
+          context - object with request_id attribute
+    Returns: HTTP response dict, the same as handler returns for the event
+    '''
+    if event.get('httpMethod', 'GET') == 'OPTIONS':
+        return PREFLIGHT
+    
+    return await run_sync(handler.__wrapped__, event, context)
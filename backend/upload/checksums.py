@@ -0,0 +1,109 @@
+'''
+Content checksums of uploads.
+
+Every stored file gets two digests of its content, computed in the same
+pass: SHA-256, which also names its blob, and CRC-32 (zlib), a cheap check
+clients can compute on any platform without a hashing library. Clients may
+send the digests they expect as lowercase hex, for a whole file and for
+every part of a chunked upload. An upload whose content does not match is
+rejected with 422 and nothing of it is kept.
+
+Chunked uploads are hashed at commit by checksum_parts(). A thread pool
+reads up to CHECKSUM_THREADS parts ahead of the part being hashed. hashlib
+and zlib release the GIL on large buffers, so reading the next parts
+overlaps with hashing the current one instead of alternating with it.
+
+Configuration (environment):
+    CHECKSUM_THREADS    - parts read ahead while a chunked upload is hashed, default 4
+'''
+import hashlib
+import os
+import re
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List
+
+from response import json_response
+from storage import Storage
+
+CHECKSUM_THREADS = int(os.environ.get('CHECKSUM_THREADS', '4'))
+CHECKSUM_FORMATS = {'sha256': re.compile(r'^[0-9a-f]{64}$'), 'crc32': re.compile(r'^[0-9a-f]{8}$')}
+
+
+class Checksum:
+    '''SHA-256, CRC-32 and length of a byte stream fed in order'''
+
+    def __init__(self) -> None:
+        self._sha256 = hashlib.sha256()
+        self.crc32 = 0
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        self._sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += len(data)
+
+    def feed(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        '''Pass chunks through unchanged while hashing them, to verify content as it is stored'''
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def hex(self) -> Dict[str, str]:
+        return {'sha256': self.sha256, 'crc32': f'{self.crc32:08x}'}
+
+    def matches(self, expected: Dict[str, str]) -> bool:
+        actual = self.hex()
+        return all(actual[name] == value for name, value in expected.items())
+
+
+def expected_checksums(source: Dict[str, Any]) -> Dict[str, str]:
+    '''
+    The sha256 and crc32 hex digests a request body or query string
+    declares, raises ValueError when one is malformed
+    '''
+    expected = {}
+    for name, pattern in CHECKSUM_FORMATS.items():
+        value = source.get(name)
+        if value is None or value == '':
+            continue
+        if not isinstance(value, str) or not pattern.match(value.lower()):
+            raise ValueError(f'invalid {name}')
+        expected[name] = value.lower()
+    return expected
+
+
+def checksum(chunks: Iterable[bytes]) -> Checksum:
+    result = Checksum()
+    for chunk in chunks:
+        result.update(chunk)
+    return result
+
+
+def read_part(storage: Storage, key: str) -> bytes:
+    return b''.join(storage.read(key))
+
+
+def checksum_parts(storage: Storage, parts: List[str]) -> Checksum:
+    '''Checksum of the parts concatenated in order, read by a thread pool ahead of hashing'''
+    result = Checksum()
+    pending: Deque[Future] = deque()
+
+    with ThreadPoolExecutor(CHECKSUM_THREADS) as pool:
+        for part in parts:
+            pending.append(pool.submit(read_part, storage, part))
+            if len(pending) > CHECKSUM_THREADS:
+                result.update(pending.popleft().result())
+        while pending:
+            result.update(pending.popleft().result())
+
+    return result
+
+
+def mismatch_response(actual: Checksum, expected: Dict[str, str]) -> Dict[str, Any]:
+    return json_response(422, {'error': 'Контрольная сумма не совпадает', 'expected': expected, 'actual': actual.hex()})
@@ -0,0 +1,182 @@
+'''
+Process-wide PostgreSQL connection pool and prepared statements.
+
+The pool is created lazily on first use and kept at module level, so warm
+invocations of the function reuse already established connections instead
+of paying for TCP, TLS and auth setup on every request. Hot queries are
+registered once with prepare() and run with execute_prepared(), which
+PREPAREs them the first time they are used on each pooled connection so
+later calls skip parsing and planning.
+
+prewarm() moves the psycopg2 import, the first connection and statement
+preparation into module import when DB_PREWARM is set, so the platform's
+init phase pays for them instead of the first request.
+
+psycopg2's pool keeps at most DB_POOL_MIN_SIZE idle connections: a
+connection returned while that many are already idle is closed, along with
+its prepared statements. An instance that serves concurrent requests above
+the minimum therefore connects and prepares again for each of them. Set
+DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE where requests overlap, at the cost of
+opening that many connections when the pool is created.
+
+Configuration (environment):
+    DATABASE_URL                    - connection string
+    DB_POOL_MIN_SIZE                - idle connections kept open, default 1
+    DB_POOL_MAX_SIZE                - upper bound of open connections, default 5
+    DB_POOL_HEALTH_CHECK_INTERVAL   - seconds a connection may stay idle before
+                                      it is pinged on checkout, default 30
+    DB_PREWARM                      - "1" to connect and prepare at import time
+'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Set
+
+from instrumentation import cursor_factory, phase
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '5'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+PREWARM = os.environ.get('DB_PREWARM', '0') == '1'
+
+_pool: Optional[Any] = None
+_pool_lock = threading.Lock()
+_last_used: Dict[int, float] = {}
+_statements: Dict[str, str] = {}
+_prepared: Dict[int, Set[str]] = {}
+
+
+def get_pool() -> Any:
+    '''Return the module-level pool, creating it on first call'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                _pool = ThreadedConnectionPool(
+                    POOL_MIN_SIZE,
+                    max(POOL_MIN_SIZE, POOL_MAX_SIZE),
+                    DATABASE_URL,
+                    cursor_factory=cursor_factory()
+                )
+    return _pool
+
+
+def close_pool() -> None:
+    '''Close every pooled connection, the next checkout opens a fresh pool'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+            _prepared.clear()
+
+
+def _forget(conn: Any) -> None:
+    _last_used.pop(id(conn), None)
+    _prepared.pop(id(conn), None)
+
+
+def _is_healthy(conn: Any) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0.0) < HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _release(pool: Any, conn: Any) -> None:
+    if not conn.closed:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    if conn.closed:
+        _forget(conn)
+        pool.putconn(conn, close=True)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn)
+        # The pool closes connections returned beyond DB_POOL_MIN_SIZE idle ones, their
+        # id() may be reused by a new connection that has prepared nothing yet
+        if conn.closed:
+            _forget(conn)
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    '''
+    Check a healthy connection out of the pool for the duration of the block.
+    Work that was not committed inside the block is rolled back on release.
+    '''
+    with phase('connect'):
+        pool = get_pool()
+        conn = pool.getconn()
+        for _ in range(POOL_MAX_SIZE):
+            if _is_healthy(conn):
+                break
+            _forget(conn)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        _release(pool, conn)
+
+
+def prepare(name: str, query: str) -> str:
+    '''
+    Register a statement written with $1, $2... placeholders under name,
+    meant to be called once at module import
+    '''
+    _statements[name] = query
+    return name
+
+
+def statement(name: str) -> str:
+    '''SQL registered under name, usable as is by drivers with $n placeholders such as asyncpg'''
+    return _statements[name]
+
+
+def execute_prepared(cur: Any, name: str, args: Sequence[Any] = ()) -> None:
+    '''Run a registered statement, preparing it on this connection first if needed'''
+    prepared = _prepared.setdefault(id(cur.connection), set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {_statements[name]}")
+        prepared.add(name)
+    if args:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def prewarm() -> None:
+    '''
+    Import psycopg2, open the pool and prepare every registered statement on
+    its first connection when DB_PREWARM is enabled. Failures are ignored,
+    the first request then connects as usual.
+    '''
+    if not PREWARM or not DATABASE_URL:
+        return
+    try:
+        import psycopg2.extras  # noqa: F401 - loaded here instead of inside the first request
+
+        with connection() as conn:
+            cur = conn.cursor()
+            prepared = _prepared.setdefault(id(conn), set())
+            for name, query in _statements.items():
+                if name not in prepared:
+                    cur.execute(f"PREPARE {name} AS {query}")
+                    prepared.add(name)
+            conn.commit()
+    except Exception:
+        pass
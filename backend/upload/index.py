@@ -2,119 +2,552 @@ import json
 import base64
 import os
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Tuple
 
+from checksums import Checksum, checksum, checksum_parts, expected_checksums, mismatch_response
+from db import connection, execute_prepared, prepare, prewarm
+from instrumentation import instrumented, phase
+from previews import enqueue_previews
+from quotas import (DEFAULT_USAGE_PAGE_SIZE, MAX_USAGE_PAGE_SIZE, base64_size, check_quota, decode_usage_cursor,
+                    list_usage, set_quota, user_usage)
+from response import METHOD_NOT_ALLOWED, json_response, preflight_response
+from storage import get_storage
+from tokens import is_admin_request, token_from_event, verify_token
+from validation import batch_item_error
+
+MAX_CHUNK_SIZE = int(os.environ.get('UPLOAD_MAX_CHUNK_SIZE', str(4 * 1024 * 1024)))
+SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', str(24 * 3600)))
+SESSION_CLEANUP_BATCH = 100
+MAX_CHUNKS = 10000
+MAX_BATCH_SIZE = 100
+DECODE_WINDOW = 64 * 1024
+
+SELECT_UPLOAD_SESSION = prepare('select_upload_session', "SELECT filename, user_id FROM upload_sessions WHERE id = $1")
+
+PREFLIGHT = preflight_response('GET, POST, PUT, OPTIONS', 'Content-Type, X-User-Id, X-Auth-Token, X-Admin-Key')
+
+
+def decode_base64_stream(data: str) -> Iterator[bytes]:
+    '''
+    Decode base64 text window by window so only one small decoded block is
+    alive at a time, raises ValueError on malformed input. Line breaks and
+    other whitespace are skipped like b64decode does, the characters of a
+    window past its last whole 4-character group carry over to the next.
+    '''
+    carry = ''
+    padded = False
+    for start in range(0, len(data), DECODE_WINDOW):
+        with phase('base64_decode'):
+            text = carry + ''.join(data[start:start + DECODE_WINDOW].split())
+            if padded and text:
+                raise ValueError('data after base64 padding')
+            end = len(text) - len(text) % 4
+            carry = text[end:]
+            padded = text[:end].endswith('=')
+            block = base64.b64decode(text[:end], validate=True)
+        if block:
+            yield block
+    if carry:
+        raise ValueError('truncated base64')
+
+
+def chunks_prefix(upload_id: str) -> str:
+    return f"uploads/{upload_id}"
+
+
+def chunk_key(upload_id: str, index: int) -> str:
+    return f"{chunks_prefix(upload_id)}/{index:05d}"
+
+
+def expire_sessions(cur: Any) -> List[str]:
+    '''
+    Drop up to SESSION_CLEANUP_BATCH sessions started more than
+    UPLOAD_SESSION_TTL seconds ago, returns their ids so the caller can
+    delete their chunks once the transaction commits
+    '''
+    cur.execute(
+        "DELETE FROM upload_sessions WHERE id = ANY(ARRAY("
+        "SELECT id FROM upload_sessions WHERE created_at < LOCALTIMESTAMP - make_interval(secs => %s) "
+        "ORDER BY created_at LIMIT %s FOR UPDATE SKIP LOCKED"
+        ")) RETURNING id",
+        (SESSION_TTL, SESSION_CLEANUP_BATCH)
+    )
+    return [str(row[0]) for row in cur.fetchall()]
+
+
+def blob_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+def find_blobs(cur: Any, digests: List[str]) -> Dict[str, str]:
+    '''Storage keys of already stored content, keyed by digest'''
+    cur.execute(
+        "SELECT sha256, storage_key FROM blobs WHERE sha256 = ANY(%s::bpchar[])",
+        (list(digests),)
+    )
+    return dict(cur.fetchall())
+
+
+def insert_files(cur: Any, user_id: int, entries: List[Tuple[str, str, Checksum, str]]) -> List[int]:
+    '''
+    Take references on the blobs and insert one files row per
+    (filename, mime_type, checksum, key) entry with a single multi-row
+    statement each, queue their previews, returns the new ids in entry order
+    '''
+    from psycopg2.extras import execute_values
+    
+    blobs: Dict[str, List[Any]] = {}
+    for _, _, content, key in entries:
+        blobs.setdefault(content.sha256, [content.sha256, content.size, key, 0])[3] += 1
+    
+    execute_values(
+        cur,
+        "INSERT INTO blobs (sha256, file_size, storage_key, ref_count) VALUES %s "
+        "ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + EXCLUDED.ref_count",
+        [tuple(blob) for blob in blobs.values()],
+        page_size=len(blobs)
+    )
+    rows = execute_values(
+        cur,
+        "INSERT INTO files (user_id, filename, file_url, file_size, mime_type, blob_sha256, crc32) VALUES %s "
+        "RETURNING id",
+        [
+            (user_id, filename, get_storage().url(key), content.size, mime_type, content.sha256, content.crc32)
+            for filename, mime_type, content, key in entries
+        ],
+        page_size=len(entries),
+        fetch=True
+    )
+    file_ids = [row[0] for row in rows]
+    enqueue_previews(cur, [(file_id, entry[1]) for file_id, entry in zip(file_ids, entries)])
+    return file_ids
+
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Handle file uploads with base64 encoding and cloud storage
-    Args: event - dict with httpMethod, body containing file data
+    Business: Handle file uploads - single base64 request or resumable chunked upload (init, PUT chunks, commit)
+    Args: event - dict with httpMethod, body containing file data or a base64 chunk, queryStringParameters
           context - object with request_id attribute
     Returns: HTTP response with file URL or error
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return PREFLIGHT
+    
+    if method == 'PUT':
+        params = event.get('queryStringParameters', {}) or {}
+        upload_id = params.get('upload_id', '')
+        
+        try:
+            uuid.UUID(upload_id)
+            index = int(params.get('index', ''))
+        except ValueError:
+            return json_response(400, {'error': 'Некорректный идентификатор загрузки или номер части'})
+        
+        data = event.get('body') or ''
+        
+        if not 0 <= index < MAX_CHUNKS or not data:
+            return json_response(400, {'error': 'Некорректный идентификатор загрузки или номер части'})
+        
+        if len(data) > MAX_CHUNK_SIZE * 4 // 3 + 4:
+            return json_response(413, {'error': 'Часть файла слишком большая'})
+        
+        try:
+            expected = expected_checksums(params)
+        except ValueError:
+            return json_response(400, {'error': 'Некорректная контрольная сумма'})
+        
+        with connection() as conn:
+            cur = conn.cursor()
+            execute_prepared(cur, SELECT_UPLOAD_SESSION, (upload_id,))
+            session = cur.fetchone()
+        
+        if not session:
+            return json_response(404, {'error': 'Загрузка не найдена'})
+        
+        storage = get_storage()
+        key = chunk_key(upload_id, index)
+        content = Checksum()
+        
+        try:
+            storage.write(key, content.feed(decode_base64_stream(data)))
+        except ValueError:
+            return json_response(400, {'error': 'Некорректные данные файла'})
+        
+        if not content.matches(expected):
+            storage.delete(key)
+            return mismatch_response(content, expected)
+        
+        return json_response(200, dict(content.hex(), upload_id=upload_id, index=index, size=content.size))
+    
+    if method == 'GET':
+        params = event.get('queryStringParameters', {}) or {}
+        
+        if params.get('usage'):
+            admin = is_admin_request(event)
+            token = token_from_event(event)
+            claims = verify_token(token) if token and not admin else None
+            
+            if not admin and not claims:
+                return json_response(403, {'error': 'Использование хранилища доступно только владельцу и администраторам'})
+            
+            try:
+                user_id = int(params['user_id']) if admin and params.get('user_id') else None
+                limit = min(max(int(params.get('limit') or DEFAULT_USAGE_PAGE_SIZE), 1), MAX_USAGE_PAGE_SIZE)
+                cursor = decode_usage_cursor(params['cursor']) if params.get('cursor') else None
+            except ValueError:
+                return json_response(400, {'error': 'Некорректные параметры запроса'})
+            
+            with connection() as conn:
+                cur = conn.cursor()
+                
+                if claims:
+                    return json_response(200, dict(user_usage(cur, claims['user_id']), user_id=claims['user_id']))
+                
+                if user_id is not None:
+                    return json_response(200, dict(user_usage(cur, user_id), user_id=user_id))
+                
+                return json_response(200, list_usage(cur, limit, cursor))
+        
+        upload_id = params.get('upload_id', '')
+        
+        try:
+            uuid.UUID(upload_id)
+        except ValueError:
+            return json_response(400, {'error': 'Некорректный идентификатор загрузки'})
+        
+        with connection() as conn:
+            cur = conn.cursor()
+            execute_prepared(cur, SELECT_UPLOAD_SESSION, (upload_id,))
+            session = cur.fetchone()
+        
+        if not session:
+            return json_response(404, {'error': 'Загрузка не найдена'})
+        
+        storage = get_storage()
+        chunks = [
+            {'index': int(key.rsplit('/', 1)[1]), 'size': storage.size(key)}
+            for key in storage.list(chunks_prefix(upload_id))
+        ]
+        
+        return json_response(200, {'upload_id': upload_id, 'filename': session[0], 'chunks': chunks})
     
     if method == 'POST':
-        import psycopg2
+        with phase('json_decode'):
+            body_data = json.loads(event.get('body', '{}'))
+        action = body_data.get('action', 'upload')
+        
+        if action == 'commit':
+            upload_id = body_data.get('upload_id', '')
+            
+            try:
+                uuid.UUID(upload_id)
+            except ValueError:
+                return json_response(400, {'error': 'Некорректный идентификатор загрузки'})
+            
+            storage = get_storage()
+            parts = storage.list(chunks_prefix(upload_id))
+            indexes = [int(key.rsplit('/', 1)[1]) for key in parts]
+            
+            try:
+                total_chunks = int(body_data.get('total_chunks', len(parts)))
+            except (ValueError, TypeError):
+                total_chunks = -1
+            
+            if not parts or indexes != list(range(total_chunks)):
+                return json_response(409, {'error': 'Получены не все части файла', 'chunks': indexes})
+            
+            try:
+                expected = expected_checksums(body_data)
+            except ValueError:
+                return json_response(400, {'error': 'Некорректная контрольная сумма'})
+            
+            content = checksum_parts(storage, parts)
+            sha256, file_size = content.sha256, content.size
+            
+            if not content.matches(expected):
+                return mismatch_response(content, expected)
+            
+            with connection() as conn:
+                cur = conn.cursor()
+                execute_prepared(cur, SELECT_UPLOAD_SESSION, (upload_id,))
+                session = cur.fetchone()
+                
+                if not session:
+                    return json_response(404, {'error': 'Загрузка не найдена'})
+                
+                over_quota = check_quota(cur, session[1], file_size, 1)
+                
+                if over_quota:
+                    return over_quota
+                
+                key = find_blobs(cur, [sha256]).get(sha256)
+            
+            deduplicated = key is not None
+            
+            if not deduplicated:
+                key = blob_key(sha256)
+                storage.concat(key, parts)
+            
+            file_url = storage.url(key)
+            
+            with connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "DELETE FROM upload_sessions WHERE id = %s RETURNING user_id, filename, mime_type",
+                    (upload_id,)
+                )
+                session = cur.fetchone()
+                
+                if not session:
+                    return json_response(404, {'error': 'Загрузка не найдена'})
+                
+                user_id, filename, mime_type = session
+                file_id = insert_files(cur, user_id, [(filename, mime_type, content, key)])[0]
+                over_quota = check_quota(cur, user_id)
+                
+                if over_quota:
+                    conn.rollback()
+                    return over_quota
+                
+                conn.commit()
+            
+            storage.delete_prefix(chunks_prefix(upload_id))
+            
+            return json_response(200, {
+                'file_id': file_id,
+                'file_url': file_url,
+                'file_size': file_size,
+                **content.hex(),
+                'deduplicated': deduplicated,
+                'message': 'Файл успешно загружен в облако'
+            })
         
-        body_data = json.loads(event.get('body', '{}'))
+        if action == 'quota':
+            if not is_admin_request(event):
+                return json_response(403, {'error': 'Квоты доступны только администраторам'})
+            
+            try:
+                user_id = int(body_data.get('user_id'))
+                quota_bytes, quota_files = [
+                    None if body_data.get(field) is None else int(body_data[field])
+                    for field in ('quota_bytes', 'quota_files')
+                ]
+                if any(quota is not None and quota < 0 for quota in (quota_bytes, quota_files)):
+                    raise ValueError('negative quota')
+            except (TypeError, ValueError):
+                return json_response(400, {'error': 'Некорректные параметры запроса'})
+            
+            with connection() as conn:
+                cur = conn.cursor()
+                
+                if not set_quota(cur, user_id, quota_bytes, quota_files):
+                    return json_response(404, {'error': 'Пользователь не найден'})
+                
+                conn.commit()
+                return json_response(200, dict(user_usage(cur, user_id), user_id=user_id))
         
         user_id = body_data.get('user_id')
         filename = body_data.get('filename')
         file_content_base64 = body_data.get('file_content')
         mime_type = body_data.get('mime_type', 'application/octet-stream')
         
-        if not all([user_id, filename, file_content_base64]):
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Отсутствуют обязательные поля'})
-            }
-        
-        db_url = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-        
-        cur.execute(
-            "SELECT user_type FROM users WHERE id = %s",
-            (user_id,)
-        )
-        user = cur.fetchone()
-        
-        if not user or user[0] != 'special':
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Только особые пользователи могут загружать файлы'})
-            }
+        token = token_from_event(event)
+        claims = verify_token(token) if token else None
         
-        try:
-            file_bytes = base64.b64decode(file_content_base64)
-            file_size = len(file_bytes)
-        except Exception as e:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Некорректные данные файла'})
-            }
-        
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_url = f"https://storage.vnefiles.cloud/{unique_filename}"
-        
-        cur.execute(
-            "INSERT INTO files (user_id, filename, file_url, file_size, mime_type) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-            (user_id, filename, file_url, file_size, mime_type)
-        )
-        
-        file_id = cur.fetchone()[0]
-        conn.commit()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({
+        if token and not claims:
+            return json_response(401, {'error': 'Недействительный токен'})
+        
+        if claims:
+            user_id = claims['user_id']
+        
+        if action == 'batch':
+            required = [user_id]
+        elif action == 'init':
+            required = [user_id, filename]
+        else:
+            required = [user_id, filename, file_content_base64]
+        
+        if not all(required):
+            return json_response(400, {'error': 'Отсутствуют обязательные поля'})
+        
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if claims:
+                user_type = claims['user_type']
+            else:
+                cur.execute(
+                    "SELECT user_type FROM users WHERE id = %s",
+                    (user_id,)
+                )
+                user = cur.fetchone()
+                user_type = user[0] if user else None
+            
+            if user_type != 'special':
+                return json_response(403, {'error': 'Только особые пользователи могут загружать файлы'})
+            
+            if action == 'init':
+                try:
+                    declared_size = int(body_data.get('file_size') or 0)
+                except (TypeError, ValueError):
+                    return json_response(400, {'error': 'Некорректный размер файла'})
+                
+                over_quota = check_quota(cur, user_id, declared_size, 1)
+                
+                if over_quota:
+                    return over_quota
+                
+                # The random upload_id is the only credential PUT, status and commit ask for
+                upload_id = str(uuid.uuid4())
+                
+                cur.execute(
+                    "INSERT INTO upload_sessions (id, user_id, filename, mime_type) VALUES (%s, %s, %s, %s)",
+                    (upload_id, user_id, filename, mime_type)
+                )
+                expired = expire_sessions(cur)
+                conn.commit()
+                
+                storage = get_storage()
+                for expired_id in expired:
+                    storage.delete_prefix(chunks_prefix(expired_id))
+                
+                return json_response(200, {'upload_id': upload_id, 'max_chunk_size': MAX_CHUNK_SIZE})
+            
+            if action == 'batch':
+                items = body_data.get('files')
+                
+                if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+                    return json_response(400, {'error': f'Передайте от 1 до {MAX_BATCH_SIZE} файлов'})
+                
+                results = [{'index': index} for index in range(len(items))]
+                valid = []
+                
+                for index, item in enumerate(items):
+                    error = batch_item_error(item, 'file_content')
+                    
+                    if not error:
+                        try:
+                            valid.append((index, item, expected_checksums(item)))
+                        except ValueError:
+                            error = 'Некорректная контрольная сумма'
+                    
+                    if error:
+                        results[index]['error'] = error
+                
+                over_quota = check_quota(
+                    cur, user_id, sum(base64_size(item['file_content']) for _, item, _ in valid), len(valid)
+                ) if valid else None
+                
+                if over_quota:
+                    return over_quota
+                
+                accepted = []
+                
+                for index, item, expected in valid:
+                    try:
+                        content = checksum(decode_base64_stream(item['file_content']))
+                    except ValueError:
+                        results[index]['error'] = 'Некорректные данные файла'
+                        continue
+                    
+                    if not content.matches(expected):
+                        results[index].update(error='Контрольная сумма не совпадает', actual=content.hex())
+                        continue
+                    
+                    accepted.append((index, item, content))
+                
+                storage = get_storage()
+                keys = find_blobs(cur, [content.sha256 for _, _, content in accepted]) if accepted else {}
+                entries = []
+                
+                for index, item, content in accepted:
+                    sha256 = content.sha256
+                    results[index].update(content.hex())
+                    results[index]['deduplicated'] = sha256 in keys
+                    
+                    if sha256 not in keys:
+                        keys[sha256] = blob_key(sha256)
+                        storage.write(keys[sha256], decode_base64_stream(item['file_content']))
+                    
+                    entries.append((
+                        item['filename'],
+                        item.get('mime_type') or 'application/octet-stream',
+                        content,
+                        keys[sha256]
+                    ))
+                
+                if entries:
+                    file_ids = insert_files(cur, user_id, entries)
+                    over_quota = check_quota(cur, user_id)
+                    
+                    if over_quota:
+                        conn.rollback()
+                        return over_quota
+                    
+                    conn.commit()
+                    
+                    for (index, _, content), file_id in zip(accepted, file_ids):
+                        results[index]['file_id'] = file_id
+                        results[index]['file_url'] = storage.url(keys[content.sha256])
+                
+                return json_response(200, {
+                    'results': results,
+                    'uploaded': len(entries),
+                    'failed': len(items) - len(entries)
+                })
+            
+            if not isinstance(file_content_base64, str):
+                return json_response(400, {'error': 'Некорректные данные файла'})
+            
+            over_quota = check_quota(cur, user_id, base64_size(file_content_base64), 1)
+            
+            if over_quota:
+                return over_quota
+            
+            try:
+                expected = expected_checksums(body_data)
+            except ValueError:
+                return json_response(400, {'error': 'Некорректная контрольная сумма'})
+            
+            try:
+                content = checksum(decode_base64_stream(file_content_base64))
+            except (TypeError, ValueError):
+                return json_response(400, {'error': 'Некорректные данные файла'})
+            
+            if not content.matches(expected):
+                return mismatch_response(content, expected)
+            
+            sha256 = content.sha256
+            storage = get_storage()
+            key = find_blobs(cur, [sha256]).get(sha256)
+            deduplicated = key is not None
+            
+            if not deduplicated:
+                key = blob_key(sha256)
+                storage.write(key, decode_base64_stream(file_content_base64))
+            
+            file_url = storage.url(key)
+            file_id = insert_files(cur, user_id, [(filename, mime_type, content, key)])[0]
+            over_quota = check_quota(cur, user_id)
+            
+            if over_quota:
+                conn.rollback()
+                return over_quota
+            
+            conn.commit()
+            
+            return json_response(200, {
                 'file_id': file_id,
                 'file_url': file_url,
+                **content.hex(),
+                'deduplicated': deduplicated,
                 'message': 'Файл успешно загружен в облако'
             })
-        }
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return METHOD_NOT_ALLOWED
+
+
+prewarm()
@@ -0,0 +1,185 @@
+'''
+Per-request timing and query instrumentation.
+
+Wrap a handler, sync or async, with @instrumented to record, for a sampled
+share of requests, how long was spent checking out a connection, running
+queries, decoding/encoding JSON and decoding base64, plus query and row counts.
+Every sampled request emits one structured JSON log line keyed by
+context.request_id and can optionally carry a Server-Timing header.
+
+Configuration (environment):
+    TRACE_SAMPLE_RATE    - share of requests to trace, 0..1, default 1
+    TRACE_SERVER_TIMING  - "1" to add a Server-Timing response header
+    TRACE_LOG            - "0" to disable the structured log line
+'''
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1'))
+TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', '0') == '1'
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') != '0'
+
+_current: ContextVar[Optional['Trace']] = ContextVar('trace', default=None)
+_cold = True
+_cursor_class: Optional[type] = None
+
+
+class Trace:
+    def __init__(self, request_id: str, function_name: str):
+        self.request_id = request_id
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.queries = 0
+        self.rows = 0
+
+    def add(self, phase_name: str, seconds: float) -> None:
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(entries)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    '''Attribute the time spent in the block to a named phase'''
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def record_query(seconds: float, rows: int) -> None:
+    '''Account a query that did not go through the psycopg2 cursor, e.g. asyncpg'''
+    trace = _current.get()
+    if trace is not None:
+        trace.add('db', seconds)
+        trace.queries += 1
+        trace.rows += rows
+
+
+def cursor_factory() -> type:
+    '''
+    psycopg2 cursor class that times execute() as the "db" phase and counts
+    queries and affected/returned rows. Built lazily to keep psycopg2 out of
+    the import path until the first connection is opened.
+    '''
+    global _cursor_class
+    if _cursor_class is None:
+        import psycopg2.extensions
+
+        class TracedCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                trace = _current.get()
+                if trace is None:
+                    return super().execute(query, vars)
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    trace.add('db', time.perf_counter() - started)
+                    trace.queries += 1
+                    trace.rows += max(self.rowcount, 0)
+
+            def executemany(self, query, vars_list):
+                trace = _current.get()
+                if trace is None:
+                    return super().executemany(query, vars_list)
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    trace.add('db', time.perf_counter() - started)
+                    trace.queries += 1
+                    trace.rows += max(self.rowcount, 0)
+
+        _cursor_class = TracedCursor
+    return _cursor_class
+
+
+def _start(context: Any) -> Optional[Tuple[Trace, Any, bool]]:
+    global _cold
+    cold, _cold = _cold, False
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    trace = Trace(getattr(context, 'request_id', None), getattr(context, 'function_name', None))
+    return trace, _current.set(trace), cold
+
+
+def _finish(started: Tuple[Trace, Any, bool], event: Dict[str, Any],
+            response: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    trace, token, cold = started
+    _current.reset(token)
+    total = time.perf_counter() - trace.started
+    if TRACE_LOG:
+        print(json.dumps({
+            'type': 'request_trace',
+            'request_id': trace.request_id,
+            'function': trace.function_name,
+            'method': event.get('httpMethod'),
+            'status': response.get('statusCode') if response else None,
+            'cold_start': cold,
+            'total_ms': round(total * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in trace.phases.items()},
+            'queries': trace.queries,
+            'rows': trace.rows
+        }), file=sys.stdout, flush=True)
+
+    if TRACE_SERVER_TIMING and response is not None and 'headers' in response:
+        # Responses may be shared precomputed envelopes, so never mutate them
+        response = dict(response, headers=dict(
+            response['headers'],
+            **{'Server-Timing': trace.server_timing(total), 'Timing-Allow-Origin': '*'}
+        ))
+    return response
+
+
+def instrumented(handler: Callable[..., Any]) -> Callable[..., Any]:
+    '''Trace a sync handler(event, context) or an async one with the same signature'''
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            started = _start(context)
+            if started is None:
+                return await handler(event, context)
+            response = None
+            try:
+                response = await handler(event, context)
+            finally:
+                response = _finish(started, event, response)
+            return response
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        started = _start(context)
+        if started is None:
+            return handler(event, context)
+        response = None
+        try:
+            response = handler(event, context)
+        finally:
+            response = _finish(started, event, response)
+        return response
+
+    return wrapper
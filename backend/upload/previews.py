@@ -0,0 +1,264 @@
+'''
+Thumbnail and text preview generation for uploaded files.
+
+Uploads never render anything: insert_files() queues a preview_jobs row for
+every new file whose type can be previewed, in the same transaction as the
+files rows, and notifies the preview_jobs channel. A worker (see
+server/preview_worker.py) claims jobs with FOR UPDATE SKIP LOCKED, so any
+number of workers share the queue without blocking each other, renders them
+in a process pool and records preview_url and preview_mime_type on the files
+row. Claiming moves run_after forward by PREVIEW_LEASE_SECONDS, which doubles
+as a lease: jobs of a worker that died become visible again once it expires.
+Failed jobs are retried with exponential backoff, at most
+PREVIEW_MAX_ATTEMPTS times.
+
+Images become JPEG thumbnails (Pillow is needed by the worker only), text
+becomes its first PREVIEW_TEXT_BYTES as UTF-8. Previews are stored by blob
+digest, so files sharing content share one preview and it is rendered once.
+
+Configuration (environment):
+    PREVIEW_THUMBNAIL_SIZE      - longest side of image thumbnails in pixels, default 320
+    PREVIEW_TEXT_BYTES          - size of text previews, default 4096
+    PREVIEW_MAX_SOURCE_BYTES    - larger images get no thumbnail, default 50 MiB
+    PREVIEW_MAX_ATTEMPTS        - tries before a job is left failed, default 5
+    PREVIEW_LEASE_SECONDS       - how long a claimed job stays invisible, default 300
+    PREVIEW_RETRY_SECONDS       - delay before the first retry, doubled on every try, default 30
+    PREVIEW_POLL_INTERVAL       - seconds the worker waits for a notification when idle, default 10
+'''
+import codecs
+import io
+import json
+import os
+import select
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import DATABASE_URL, connection
+from storage import get_storage
+
+PREVIEW_THUMBNAIL_SIZE = int(os.environ.get('PREVIEW_THUMBNAIL_SIZE', '320'))
+PREVIEW_TEXT_BYTES = int(os.environ.get('PREVIEW_TEXT_BYTES', '4096'))
+PREVIEW_MAX_SOURCE_BYTES = int(os.environ.get('PREVIEW_MAX_SOURCE_BYTES', str(50 * 1024 * 1024)))
+PREVIEW_MAX_ATTEMPTS = int(os.environ.get('PREVIEW_MAX_ATTEMPTS', '5'))
+PREVIEW_LEASE_SECONDS = int(os.environ.get('PREVIEW_LEASE_SECONDS', '300'))
+PREVIEW_RETRY_SECONDS = int(os.environ.get('PREVIEW_RETRY_SECONDS', '30'))
+PREVIEW_POLL_INTERVAL = float(os.environ.get('PREVIEW_POLL_INTERVAL', '10'))
+PREVIEW_CHANNEL = 'preview_jobs'
+THUMBNAIL_MAX_PIXELS = 100_000_000
+
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff'}
+TEXT_TYPES = {
+    'application/json', 'application/xml', 'application/javascript',
+    'application/x-yaml', 'application/yaml', 'application/sql'
+}
+
+
+def preview_kind(mime_type: Optional[str]) -> Optional[str]:
+    '''"image", "text" or None when files of this type get no preview'''
+    mime_type = (mime_type or '').split(';')[0].strip().lower()
+    if mime_type in IMAGE_TYPES:
+        return 'image'
+    if mime_type.startswith('text/') or mime_type in TEXT_TYPES:
+        return 'text'
+    return None
+
+
+def enqueue_previews(cur: Any, files: List[Tuple[int, Optional[str]]]) -> None:
+    '''Queue preview jobs for the previewable (file_id, mime_type) pairs, delivered on commit'''
+    file_ids = [file_id for file_id, mime_type in files if preview_kind(mime_type)]
+    if not file_ids:
+        return
+    cur.execute(
+        "WITH queued AS (INSERT INTO preview_jobs (file_id) SELECT unnest(%s::int[]) RETURNING file_id) "
+        "SELECT pg_notify(%s, COUNT(*)::text) FROM queued",
+        (file_ids, PREVIEW_CHANNEL)
+    )
+
+
+def preview_key(sha256: str, kind: str) -> str:
+    return f"previews/{sha256[:2]}/{sha256}.{'jpg' if kind == 'image' else 'txt'}"
+
+
+def render_thumbnail(data: bytes) -> Optional[bytes]:
+    '''
+    JPEG no larger than PREVIEW_THUMBNAIL_SIZE on either side, transparency
+    flattened onto white, None when data is not an image Pillow can decode
+    '''
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_PIXELS
+
+    size = (PREVIEW_THUMBNAIL_SIZE, PREVIEW_THUMBNAIL_SIZE)
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            # JPEG sources are decoded at a reduced scale, far cheaper than a full decode
+            source.draft('RGB', size)
+            image = ImageOps.exif_transpose(source)
+            image.thumbnail(size)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        return None
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        flattened = Image.new('RGB', image.size, (255, 255, 255))
+        flattened.paste(image, mask=image.getchannel('A'))
+        image = flattened
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=80, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def render_text(data: bytes) -> bytes:
+    '''The data as UTF-8, a multi-byte character cut off at the end is dropped'''
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    return decoder.decode(data, final=False).encode()
+
+
+def render_preview(kind: str, sha256: str, storage_key: str) -> Optional[Tuple[str, str]]:
+    '''
+    Store the preview of a blob and return (url, mime type), None when the
+    source is too large or cannot be decoded. Runs in the worker's process pool.
+    '''
+    storage = get_storage()
+    key = preview_key(sha256, kind)
+    mime_type = 'image/jpeg' if kind == 'image' else 'text/plain; charset=utf-8'
+
+    if storage.size(key) is None:
+        if kind == 'image':
+            size = storage.size(storage_key)
+            if size is None or size > PREVIEW_MAX_SOURCE_BYTES:
+                return None
+            preview = render_thumbnail(b''.join(storage.read(storage_key)))
+            if preview is None:
+                return None
+        else:
+            preview = render_text(storage.read_range(storage_key, 0, PREVIEW_TEXT_BYTES))
+        storage.write(key, [preview])
+
+    return storage.url(key), mime_type
+
+
+def claim_jobs(cur: Any, limit: int) -> List[Tuple[int, int, Optional[str], Optional[str], Optional[str]]]:
+    '''
+    Lease up to limit due jobs, skipping the ones other workers hold, and
+    return (file_id, attempts, mime_type, blob_sha256, storage_key) rows
+    '''
+    cur.execute(
+        "WITH claimed AS ("
+        "SELECT file_id FROM preview_jobs WHERE run_after <= now() AND attempts < %s "
+        "ORDER BY run_after LIMIT %s FOR UPDATE SKIP LOCKED) "
+        "UPDATE preview_jobs j SET attempts = j.attempts + 1, run_after = now() + make_interval(secs => %s) "
+        "FROM claimed JOIN files f ON f.id = claimed.file_id LEFT JOIN blobs b ON b.sha256 = f.blob_sha256 "
+        "WHERE j.file_id = claimed.file_id "
+        "RETURNING j.file_id, j.attempts, f.mime_type, f.blob_sha256, b.storage_key",
+        (PREVIEW_MAX_ATTEMPTS, limit, PREVIEW_LEASE_SECONDS)
+    )
+    return cur.fetchall()
+
+
+def finish_jobs(cur: Any, file_ids: List[int], previews: List[Tuple[int, str, str]]) -> None:
+    '''Record the (file_id, preview_url, preview_mime_type) previews and drop the finished jobs'''
+    from psycopg2.extras import execute_values
+
+    if previews:
+        execute_values(
+            cur,
+            "UPDATE files f SET preview_url = v.url, preview_mime_type = v.mime_type "
+            "FROM (VALUES %s) AS v (id, url, mime_type) WHERE f.id = v.id",
+            previews,
+            page_size=len(previews)
+        )
+    cur.execute("DELETE FROM preview_jobs WHERE file_id = ANY(%s)", (file_ids,))
+
+
+def fail_job(cur: Any, file_id: int, attempts: int, error: str) -> None:
+    '''Keep the job for a retry after an exponential backoff, remembering why it failed'''
+    cur.execute(
+        "UPDATE preview_jobs SET last_error = %s, run_after = now() + make_interval(secs => %s) WHERE file_id = %s",
+        (error[:1000], PREVIEW_RETRY_SECONDS * 2 ** (attempts - 1), file_id)
+    )
+
+
+def process_batch(pool: ProcessPoolExecutor, batch_size: int) -> int:
+    '''Claim, render and record one batch of jobs, returns how many were claimed'''
+    with connection() as conn:
+        jobs = claim_jobs(conn.cursor(), batch_size)
+        conn.commit()
+
+    if not jobs:
+        return 0
+
+    finished = []
+    previews = []
+    failed = []
+    renders: Dict[Tuple[str, str, str], List[Tuple[int, int]]] = {}
+
+    for file_id, attempts, mime_type, sha256, storage_key in jobs:
+        kind = preview_kind(mime_type)
+        if kind and sha256 and storage_key:
+            # Files sharing a blob in one batch are rendered once
+            renders.setdefault((kind, sha256, storage_key), []).append((file_id, attempts))
+        else:
+            finished.append(file_id)
+
+    futures = {pool.submit(render_preview, *render): files for render, files in renders.items()}
+
+    for future in as_completed(futures):
+        try:
+            preview = future.result()
+        except Exception as e:
+            failed.extend((file_id, attempts, f'{type(e).__name__}: {e}') for file_id, attempts in futures[future])
+            continue
+        for file_id, _ in futures[future]:
+            finished.append(file_id)
+            if preview:
+                previews.append((file_id,) + preview)
+
+    with connection() as conn:
+        cur = conn.cursor()
+        finish_jobs(cur, finished, previews)
+        for file_id, attempts, error in failed:
+            fail_job(cur, file_id, attempts, error)
+        conn.commit()
+
+    print(json.dumps({
+        'type': 'preview_batch',
+        'claimed': len(jobs),
+        'rendered': len(previews),
+        'skipped': len(finished) - len(previews),
+        'failed': len(failed)
+    }), file=sys.stdout, flush=True)
+    return len(jobs)
+
+
+def wait_for_jobs(listener: Any, timeout: float) -> None:
+    '''Block until a preview_jobs notification arrives or timeout passes'''
+    if select.select([listener], [], [], timeout)[0]:
+        listener.poll()
+        listener.notifies.clear()
+
+
+def run_worker(processes: Optional[int] = None, batch_size: int = 32, once: bool = False) -> None:
+    '''
+    Process the queue with a pool of processes, forever or, with once, until
+    no job is due. An idle worker sleeps until an upload notifies it.
+    '''
+    import psycopg2
+
+    listener = psycopg2.connect(DATABASE_URL)
+    listener.autocommit = True
+    listener.cursor().execute(f'LISTEN {PREVIEW_CHANNEL}')
+
+    try:
+        with ProcessPoolExecutor(processes) as pool:
+            while True:
+                if process_batch(pool, batch_size):
+                    continue
+                if once:
+                    return
+                wait_for_jobs(listener, PREVIEW_POLL_INTERVAL)
+    finally:
+        listener.close()
@@ -0,0 +1,127 @@
+'''
+Per-user storage quotas.
+
+user_stats keeps bytes_used next to files_count. The trg_files_user_stats
+trigger updates both in the transaction that inserts or deletes a files row,
+so the usage of a user is a single primary key read and never a SUM over
+files. Bytes are counted per file: a deduplicated upload still counts its
+full size against the quota of the user who uploaded it.
+
+Every path that inserts files rows checks the quota twice: the upload
+function for stored content, the files function for files registered by
+URL. The first check runs before the payload is decoded, with the size the
+base64 text will decode to (or the declared size), so an upload that cannot
+fit is rejected without being read. The second check runs after the files
+rows are inserted, in the same transaction. By then the trigger has counted
+the new rows and holds the user's user_stats row lock, so concurrent uploads
+of one user cannot all pass the first check and end up over the limit
+together. A blob written by an upload that fails the second check is left
+unreferenced.
+
+Configuration (environment):
+    QUOTA_BYTES     - bytes a user may store unless user_stats.quota_bytes is set,
+                      default 10 GiB, 0 for no limit
+    QUOTA_FILES     - files a user may store unless user_stats.quota_files is set,
+                      default 100000, 0 for no limit
+'''
+import base64
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import execute_prepared, prepare
+from response import json_response
+
+QUOTA_BYTES = int(os.environ.get('QUOTA_BYTES', str(10 * 1024 ** 3)))
+QUOTA_FILES = int(os.environ.get('QUOTA_FILES', '100000'))
+DEFAULT_USAGE_PAGE_SIZE = 50
+MAX_USAGE_PAGE_SIZE = 200
+
+SELECT_USAGE = prepare(
+    'select_usage',
+    "SELECT bytes_used, files_count, quota_bytes, quota_files FROM user_stats WHERE user_id = $1"
+)
+
+
+def base64_size(data: str) -> int:
+    '''Length of the bytes base64 text decodes to, without decoding it'''
+    return len(data) // 4 * 3 - data[-2:].count('=')
+
+
+def usage_from_row(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    '''Usage of a (bytes_used, files_count, quota_bytes, quota_files) row, unset limits replaced by the defaults'''
+    return {
+        'bytes_used': row[0],
+        'files_count': row[1],
+        'quota_bytes': QUOTA_BYTES if row[2] is None else row[2],
+        'quota_files': QUOTA_FILES if row[3] is None else row[3]
+    }
+
+
+def user_usage(cur: Any, user_id: int) -> Dict[str, Any]:
+    '''Usage and limits of a user, zero usage for a user without files'''
+    execute_prepared(cur, SELECT_USAGE, (user_id,))
+    return usage_from_row(cur.fetchone() or (0, 0, None, None))
+
+
+def exceeds(usage: Dict[str, Any], add_bytes: int = 0, add_files: int = 0) -> bool:
+    return bool(
+        usage['quota_bytes'] and usage['bytes_used'] + add_bytes > usage['quota_bytes']
+        or usage['quota_files'] and usage['files_count'] + add_files > usage['quota_files']
+    )
+
+
+def check_quota(cur: Any, user_id: int, add_bytes: int = 0, add_files: int = 0) -> Optional[Dict[str, Any]]:
+    '''
+    413 response when add_bytes more bytes in add_files more files would
+    put the user over a limit, None when it fits. Called with nothing to add
+    after the files rows are inserted, it checks the counters the trigger
+    already updated.
+    '''
+    usage = user_usage(cur, user_id)
+
+    if not exceeds(usage, add_bytes, add_files):
+        return None
+
+    return json_response(413, {'error': 'Превышена квота хранилища', 'usage': usage})
+
+
+def encode_usage_cursor(bytes_used: int, user_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([bytes_used, user_id]).encode()).decode()
+
+
+def decode_usage_cursor(cursor: str) -> Tuple[int, int]:
+    '''Reverse of encode_usage_cursor, raises ValueError on malformed input'''
+    try:
+        bytes_used, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(bytes_used), int(user_id)
+    except (TypeError, ValueError, json.JSONDecodeError):
+        raise ValueError('invalid cursor')
+
+
+def list_usage(cur: Any, limit: int, cursor: Optional[Tuple[int, int]]) -> Dict[str, Any]:
+    '''Users by bytes used, largest first, one keyset page of limit users'''
+    where = "WHERE (s.bytes_used, s.user_id) < (%s, %s) " if cursor else ""
+    cur.execute(
+        "SELECT s.user_id, u.email, s.bytes_used, s.files_count, s.quota_bytes, s.quota_files "
+        "FROM user_stats s JOIN users u ON u.id = s.user_id "
+        f"{where}ORDER BY s.bytes_used DESC, s.user_id DESC LIMIT %s",
+        list(cursor or ()) + [limit + 1]
+    )
+    rows = cur.fetchall()
+    users: List[Dict[str, Any]] = [
+        dict(usage_from_row(row[2:]), user_id=row[0], email=row[1]) for row in rows[:limit]
+    ]
+    next_cursor = encode_usage_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+    return {'users': users, 'next_cursor': next_cursor}
+
+
+def set_quota(cur: Any, user_id: int, quota_bytes: Optional[int], quota_files: Optional[int]) -> bool:
+    '''Override the limits of a user, None restores a default, False when the user does not exist'''
+    cur.execute(
+        "INSERT INTO user_stats (user_id, quota_bytes, quota_files) SELECT id, %s, %s FROM users WHERE id = %s "
+        "ON CONFLICT (user_id) DO UPDATE SET quota_bytes = EXCLUDED.quota_bytes, quota_files = EXCLUDED.quota_files "
+        "RETURNING user_id",
+        (quota_bytes, quota_files, user_id)
+    )
+    return cur.fetchone() is not None
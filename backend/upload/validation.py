@@ -0,0 +1,36 @@
+'''
+Validation of batch upload entries.
+
+The files function's upload_batch action registers files by URL, the upload
+function's batch action stores base64 content. Both check every entry here
+before any quota, storage or database work, so one bad entry is reported in
+its result instead of failing the INSERT, and with it the whole batch, on a
+column limit of the files table.
+'''
+from typing import Any, Optional
+
+MAX_FILENAME_LENGTH = 255
+MAX_MIME_TYPE_LENGTH = 100
+
+
+def batch_item_error(item: Any, content_field: str) -> Optional[str]:
+    '''
+    Validation error of one batch entry whose content is the string in
+    content_field (file_url or file_content), None when it can be inserted
+    '''
+    if not isinstance(item, dict):
+        return 'Некорректная запись файла'
+    filename = item.get('filename')
+    if not filename or not isinstance(filename, str) or len(filename) > MAX_FILENAME_LENGTH:
+        return 'Некорректное имя файла'
+    if not item.get(content_field) or not isinstance(item[content_field], str):
+        return f'Отсутствует {content_field}'
+    mime_type = item.get('mime_type') or ''
+    if not isinstance(mime_type, str) or len(mime_type) > MAX_MIME_TYPE_LENGTH:
+        return 'Некорректный mime_type'
+    try:
+        if int(item.get('file_size') or 0) < 0:
+            return 'Некорректный размер файла'
+    except (TypeError, ValueError):
+        return 'Некорректный размер файла'
+    return None
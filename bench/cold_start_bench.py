@@ -0,0 +1,132 @@
+'''
+Cold-start benchmark for the backend functions.
+
+Every function in backend/func2url.json is started in a fresh Python
+process, as the platform does for a cold instance, and the harness records
+how long importing index.py takes, the latency of the first request and of
+the following warm request. Each function is measured with and without
+DB_PREWARM so the cost moved from the first request into import time is
+visible. Results are the medians over --runs processes, written as JSON.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/vnefiles_bench \\
+        python bench/cold_start_bench.py --runs 10 --output cold_start.json
+'''
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+
+# A representative request per function that reaches the database
+FIRST_REQUESTS: Dict[str, Dict[str, Any]] = {
+    'auth': {
+        'httpMethod': 'POST',
+        'body': json.dumps({'action': 'login', 'email': 'cold-start@bench.local', 'password': 'bench'})
+    },
+    'files': {'httpMethod': 'GET', 'queryStringParameters': {'limit': '50'}},
+    'profile': {'httpMethod': 'GET', 'queryStringParameters': {'user_id': '1'}},
+    'upload': {'httpMethod': 'GET', 'queryStringParameters': {'upload_id': str(uuid.UUID(int=0))}}
+}
+
+
+def child(name: str) -> None:
+    '''Measure one cold process, print the timings as a JSON line'''
+    directory = os.path.join(BACKEND, name)
+    sys.path.insert(0, directory)
+    context = types.SimpleNamespace(request_id='cold-start', function_name=name)
+    event = FIRST_REQUESTS.get(name, {'httpMethod': 'OPTIONS'})
+
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('index', os.path.join(directory, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+    first = module.handler(dict(event), context)
+    first_done = time.perf_counter()
+    module.handler(dict(event), context)
+    warm_done = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'first_request_ms': (first_done - imported) * 1000,
+        'warm_request_ms': (warm_done - first_done) * 1000,
+        'status': first['statusCode']
+    }))
+
+
+def run(name: str, prewarm: bool, runs: int) -> Dict[str, Any]:
+    env = dict(os.environ, DB_PREWARM='1' if prewarm else '0', TRACE_LOG='0')
+    samples: List[Dict[str, Any]] = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    result: Dict[str, Any] = {
+        key: round(statistics.median(sample[key] for sample in samples), 3)
+        for key in ('import_ms', 'first_request_ms', 'warm_request_ms')
+    }
+    result['cold_total_ms'] = round(result['import_ms'] + result['first_request_ms'], 3)
+    result['statuses'] = sorted({sample['status'] for sample in samples})
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per function and mode')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('STORAGE_ROOT', tempfile.mkdtemp(prefix='vnefiles-bench-'))
+
+    with open(os.path.join(BACKEND, 'func2url.json')) as f:
+        names = list(json.load(f))
+
+    results = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'functions': {}
+    }
+    for name in names:
+        results['functions'][name] = {
+            'lazy': run(name, False, args.runs),
+            'prewarm': run(name, True, args.runs)
+        }
+        for mode, result in results['functions'][name].items():
+            print(f"{name:>8} {mode:>7}: import {result['import_ms']} ms, "
+                  f"first request {result['first_request_ms']} ms, warm {result['warm_request_ms']} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
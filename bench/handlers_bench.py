@@ -0,0 +1,291 @@
+'''
+Offline load-test and benchmark harness for the backend functions.
+
+Every function in backend/func2url.json is imported in-process and its
+handler(event, context) is called directly against a local PostgreSQL
+database that is seeded with a configurable number of users and files.
+For each action the harness reports p50/p95/p99 latency, queries and
+allocated bytes per request, and writes the results as JSON so they can
+be compared between releases. Actions served from an in-process cache are
+measured twice: "list" and "profile_get" clear the cache before every
+request and vary what they ask for, "list_cached" and "profile_get_cached"
+repeat one request the cache answers.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/vnefiles_bench \\
+        python bench/handlers_bench.py --migrate --users 1000 --files 100000 --output bench.json
+'''
+import argparse
+import base64
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+BENCH_PASSWORD = 'bench-password'
+
+query_count = 0
+
+
+def load_function(name: str) -> types.ModuleType:
+    '''
+    Import backend/<name>/index.py with its own sibling modules. Functions
+    ship modules with the same names (db, cache, ...), so those are dropped
+    from sys.modules before and after each import to keep them separate.
+    '''
+    directory = os.path.join(BACKEND, name)
+
+    def purge() -> None:
+        for module_name, module in list(sys.modules.items()):
+            if (getattr(module, '__file__', None) or '').startswith(BACKEND + os.sep):
+                del sys.modules[module_name]
+
+    purge()
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f'bench_{name}', os.path.join(directory, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.db = sys.modules['db']
+    finally:
+        sys.path.remove(directory)
+        purge()
+    return module
+
+
+def counting_pool(dsn: str) -> Any:
+    '''Connection pool whose cursors count executed statements'''
+    import psycopg2.extensions
+    from psycopg2.pool import ThreadedConnectionPool
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            global query_count
+            query_count += 1
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            global query_count
+            query_count += 1
+            return super().executemany(query, vars_list)
+
+    return ThreadedConnectionPool(1, 4, dsn, cursor_factory=CountingCursor)
+
+
+def migrate(dsn: str) -> None:
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        for path in sorted(glob.glob(os.path.join(MIGRATIONS, 'V*.sql'))):
+            with open(path) as f:
+                cur.execute(f.read())
+    conn.close()
+
+
+def seed(dsn: str, users: int, files: int) -> Tuple[List[int], List[int]]:
+    '''Bulk-insert bench users and files, return their ids'''
+    import psycopg2
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password_hash, user_type, is_verified) "
+            "SELECT 'bench-' || md5(random()::text) || '@bench.local', %s, "
+            "CASE WHEN g %% 2 = 0 THEN 'special' ELSE 'regular' END, g %% 2 = 0 "
+            "FROM generate_series(1, %s) g RETURNING id",
+            (password_hash, users)
+        )
+        user_ids = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            "INSERT INTO files (user_id, filename, file_url, file_size, mime_type, downloads_count, created_at) "
+            "SELECT u.ids[1 + (g %% array_length(u.ids, 1))], 'file-' || g || '.bin', "
+            "'https://storage.vnefiles.cloud/bench/' || g, (random() * 10485760)::bigint, "
+            "(ARRAY['application/pdf', 'image/png', 'text/plain', 'video/mp4'])[1 + g %% 4], "
+            "(random() * 1000)::int, now() - g * interval '1 second' "
+            "FROM generate_series(1, %s) g, (SELECT array_agg(id) AS ids FROM users WHERE user_type = 'special') u "
+            "RETURNING id",
+            (files,)
+        )
+        file_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return user_ids, file_ids
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def measure(call: Callable[[], Dict[str, Any]], iterations: int, alloc_iterations: int) -> Dict[str, Any]:
+    global query_count
+    latencies = []
+    queries = []
+    statuses: Dict[str, int] = {}
+
+    for _ in range(iterations):
+        query_count = 0
+        started = time.perf_counter()
+        response = call()
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(query_count)
+        statuses[str(response['statusCode'])] = statuses.get(str(response['statusCode']), 0) + 1
+
+    allocated = []
+    tracemalloc.start()
+    for _ in range(alloc_iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call()
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'peak_alloc_bytes': int(statistics.fmean(allocated)) if allocated else None,
+        'statuses': statuses
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations before seeding')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--alloc-iterations', type=int, default=20)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help='bytes per uploaded file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('STORAGE_ROOT', tempfile.mkdtemp(prefix='vnefiles-bench-'))
+    # Repeated logins from one process would otherwise be throttled by the auth rate limiter
+    os.environ.setdefault('RATE_LIMIT_IP_BURST', '0')
+    os.environ.setdefault('RATE_LIMIT_EMAIL_BURST', '0')
+    # One JSON trace line per request would be timed and allocated as part of every handler
+    os.environ['TRACE_LOG'] = '0'
+    random.seed(args.seed)
+
+    if args.migrate:
+        migrate(args.dsn)
+    user_ids, file_ids = seed(args.dsn, args.users, args.files)
+
+    with open(os.path.join(BACKEND, 'func2url.json')) as f:
+        functions = {name: load_function(name) for name in json.load(f)}
+    for module in functions.values():
+        module.db._pool = counting_pool(args.dsn)
+
+    context = types.SimpleNamespace(request_id='bench', function_name='bench')
+    with functions['auth'].db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, email FROM users WHERE id = ANY(%s) AND user_type = 'special' LIMIT 1", (user_ids,))
+        special_user_id, login_email = cur.fetchone()
+
+    counter = iter(range(10 ** 9))
+
+    def post(name: str, body: Dict[str, Any]) -> Callable[[], Dict[str, Any]]:
+        return lambda: functions[name].handler({'httpMethod': 'POST', 'body': json.dumps(body)}, context)
+
+    def register() -> Dict[str, Any]:
+        body = {'action': 'register', 'email': f'bench-reg-{next(counter)}-{time.time_ns()}@bench.local',
+                'password': BENCH_PASSWORD}
+        return functions['auth'].handler({'httpMethod': 'POST', 'body': json.dumps(body)}, context)
+
+    def list_files(params: Dict[str, Any]) -> Dict[str, Any]:
+        return functions['files'].handler({'httpMethod': 'GET', 'queryStringParameters': params}, context)
+
+    # Pages an uncached listing is sampled from: different limits and filters and the
+    # first pages of the catalogue reached by following next_cursor
+    list_params: List[Dict[str, Any]] = [
+        {'limit': str(limit)} for limit in (10, 50, 200)
+    ] + [
+        {'mime_type': mime_type} for mime_type in ('application/pdf', 'image/png')
+    ] + [
+        {'uploader_id': str(special_user_id)}, {'min_size': '1048576', 'max_size': '5242880'}
+    ]
+    cursor = None
+    for _ in range(10):
+        page = json.loads(list_files(dict(cursor=cursor) if cursor else {})['body'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+        list_params.append({'cursor': cursor})
+
+    def list_uncached() -> Dict[str, Any]:
+        functions['files'].page_cache.clear()
+        return list_files(random.choice(list_params))
+
+    def upload() -> Dict[str, Any]:
+        content = base64.b64encode(os.urandom(args.upload_size)).decode()
+        body = {'user_id': special_user_id, 'filename': 'bench.bin', 'file_content': content}
+        return functions['upload'].handler({'httpMethod': 'POST', 'body': json.dumps(body)}, context)
+
+    def download() -> Dict[str, Any]:
+        body = {'action': 'download', 'file_id': random.choice(file_ids)}
+        return functions['files'].handler({'httpMethod': 'POST', 'body': json.dumps(body)}, context)
+
+    def profile_get(user_id: int) -> Dict[str, Any]:
+        params = {'user_id': str(user_id)}
+        return functions['profile'].handler({'httpMethod': 'GET', 'queryStringParameters': params}, context)
+
+    def profile_get_uncached() -> Dict[str, Any]:
+        functions['profile'].profile_cache.clear()
+        return profile_get(random.choice(user_ids))
+
+    actions = {
+        'register': register,
+        'login': post('auth', {'action': 'login', 'email': login_email, 'password': BENCH_PASSWORD}),
+        'list': list_uncached,
+        'list_cached': lambda: list_files({}),
+        'upload': upload,
+        'download': download,
+        'profile_get': profile_get_uncached,
+        'profile_get_cached': lambda: profile_get(special_user_id),
+        'profile_update': post('profile', {'user_id': special_user_id, 'full_name': 'Bench', 'bio': 'bench'})
+    }
+
+    results = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'dataset': {'users': args.users, 'files': args.files, 'upload_size': args.upload_size},
+        'actions': {}
+    }
+    for name, call in actions.items():
+        call()
+        results['actions'][name] = measure(call, args.iterations, args.alloc_iterations)
+        print(f"{name:>18}: p50 {results['actions'][name]['p50_ms']} ms, "
+              f"p99 {results['actions'][name]['p99_ms']} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+'''
+Query plan regression check for the backend functions.
+
+Every function is imported in-process, as in handlers_bench.py, and a
+scenario per handler path is run against a seeded local PostgreSQL
+database. Right before a handler sends a statement, the same statement is
+run with EXPLAIN (ANALYZE, BUFFERS) on its connection inside a savepoint
+that is rolled back, so every plan is taken in the exact state the handler
+sees; statements of named cursors are explained as DECLARE, which is planned
+for the first rows like the real cursor. The check fails when a plan reads a
+table of --seq-scan-rows rows or more with a sequential scan, or touches more
+shared buffers than the budget, so a missing index shows up before it
+reaches production.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/vnefiles_plans \\
+        python bench/plan_check.py --migrate --files 50000 --buffer-budget 1000 --output plans.json
+'''
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import tempfile
+import types
+from typing import Any, Dict, Iterator, List, Tuple
+
+from handlers_bench import BACKEND, BENCH_PASSWORD, load_function, migrate, seed
+
+# Batch statements whose cost grows with the batch they process, seed_derived() queues about
+# files / 100 download events, so this allows roughly 70 buffers per event
+BUFFER_BUDGETS = {'flush_download_events': 25000}
+EXPLAINED = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|EXECUTE)\b', re.IGNORECASE)
+HEALTH_CHECK = 'SELECT 1'
+ADMIN_KEY = 'plan-check-admin-key'
+
+results: List[Dict[str, Any]] = []
+current_scenario = ''
+
+
+def explaining_pool(dsn: str) -> Any:
+    '''Connection pool whose cursors explain every statement before sending it'''
+    import psycopg2.extensions
+    from psycopg2.pool import ThreadedConnectionPool
+
+    class ExplainingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            # execute_values() sends bytes with the values already inlined
+            text = query.decode() if isinstance(query, bytes) else query
+            if current_scenario and EXPLAINED.match(text) and text.strip() != HEALTH_CHECK:
+                # A plain cursor, named (server-side) cursors can run a single statement only
+                plain = psycopg2.extensions.cursor(self.connection)
+                sql = self.mogrify(query, vars).decode()
+                result = explain(plain, f'DECLARE plan_check CURSOR FOR {sql}' if self.name else sql)
+                results.append(dict(result, scenario=current_scenario, query=' '.join(text.split())))
+            return super().execute(query, vars)
+
+    return ThreadedConnectionPool(1, 4, dsn, cursor_factory=ExplainingCursor)
+
+
+def seed_derived(dsn: str) -> None:
+    '''Fill the tables seed() leaves empty: blobs, pending download events and rankings'''
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "WITH hashed AS (UPDATE files SET blob_sha256 = encode(sha256(id::text::bytea), 'hex') "
+            "WHERE blob_sha256 IS NULL RETURNING blob_sha256, file_size) "
+            "INSERT INTO blobs (sha256, file_size, storage_key, ref_count) "
+            "SELECT blob_sha256, file_size, 'blobs/' || left(blob_sha256, 2) || '/' || blob_sha256, 1 FROM hashed"
+        )
+        cur.execute(
+            "INSERT INTO download_events (file_id, created_at) "
+            "SELECT id, LOCALTIMESTAMP - (id % 48) * INTERVAL '1 hour' FROM files WHERE id % 100 = 0"
+        )
+        cur.execute(
+            "INSERT INTO file_rankings (period, file_id, uploader_id, downloads) "
+            "SELECT w.period, f.id, f.user_id, GREATEST(f.downloads_count / CASE w.period WHEN '24h' THEN 30 "
+            "WHEN '7d' THEN 4 ELSE 1 END, 1) FROM files f, ranking_windows w "
+            "WHERE f.id % CASE w.period WHEN '24h' THEN 20 WHEN '7d' THEN 5 ELSE 1 END = 0 "
+            "ON CONFLICT (period, file_id) DO UPDATE SET downloads = EXCLUDED.downloads"
+        )
+    conn.close()
+
+
+def plan_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def shared_buffers(plan: Dict[str, Any]) -> int:
+    '''
+    Shared buffers the statement touched. Data-modifying CTEs no CTE Scan reads
+    run after the main query and are not part of the top node's counters.
+    '''
+    def touched(node: Dict[str, Any]) -> int:
+        return node.get('Shared Hit Blocks', 0) + node.get('Shared Read Blocks', 0)
+
+    scanned = {node.get('CTE Name') for node in plan_nodes(plan) if node['Node Type'] == 'CTE Scan'}
+    return touched(plan) + sum(
+        touched(node) for node in plan.get('Plans', [])
+        if node['Node Type'] == 'ModifyTable' and node.get('Subplan Name', '').removeprefix('CTE ') not in scanned
+    )
+
+
+def explain(cur: Any, sql: str) -> Dict[str, Any]:
+    '''EXPLAIN (ANALYZE, BUFFERS) of one statement, its side effects rolled back'''
+    import psycopg2
+    cur.execute('SAVEPOINT plan_check')
+    try:
+        cur.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}')
+        plan = cur.fetchone()[0][0]['Plan']
+    except psycopg2.Error as e:
+        return {'seq_scans': [], 'shared_buffers': 0, 'actual_ms': 0.0, 'error': ' '.join(str(e).split())}
+    finally:
+        cur.execute('ROLLBACK TO SAVEPOINT plan_check')
+
+    return {
+        'seq_scans': sorted({node['Relation Name'] for node in plan_nodes(plan) if node['Node Type'] == 'Seq Scan'}),
+        'shared_buffers': shared_buffers(plan),
+        'actual_ms': round(plan.get('Actual Total Time', 0.0), 3)
+    }
+
+
+def scenarios(functions: Dict[str, Any], user_ids: List[int], file_ids: List[int],
+              special_user_id: int, login_email: str) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    '''Scenario name -> (function, event), one per handler path that reaches the database'''
+    def get(**params: str) -> Dict[str, Any]:
+        return {'httpMethod': 'GET', 'queryStringParameters': params}
+
+    def post(body: Dict[str, Any], **headers: str) -> Dict[str, Any]:
+        return {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': headers}
+
+    content = base64.b64encode(os.urandom(4096)).decode()
+    page = functions['files'].handler(get(limit='20'), types.SimpleNamespace(request_id='plan', function_name='files'))
+    cursor = json.loads(page['body'])['next_cursor']
+
+    return {
+        'login': ('auth', post({'action': 'login', 'email': login_email, 'password': BENCH_PASSWORD})),
+        'register': ('auth', post({'action': 'register', 'email': 'plan-check@bench.local', 'password': BENCH_PASSWORD})),
+        'list_latest': ('files', get(limit='50')),
+        'list_next_page': ('files', get(limit='20', cursor=cursor)),
+        'list_by_uploader': ('files', get(uploader_id=str(special_user_id))),
+        'list_by_mime_type': ('files', get(mime_type='image/')),
+        'list_by_size': ('files', get(min_size='1048576', max_size='2097152')),
+        'search_substring': ('files', get(search='file-123')),
+        'search_fulltext': ('files', get(search='file 123', mode='fulltext')),
+        'top_all': ('files', get(mode='top')),
+        'top_24h_by_uploader': ('files', get(mode='top', period='24h', uploader_id=str(special_user_id))),
+        'download': ('files', post({'action': 'download', 'file_id': file_ids[0]})),
+        'download_content': ('files', get(download=str(file_ids[1]))),
+        'export': ('files', {'httpMethod': 'GET', 'queryStringParameters': {'export': 'ndjson', 'after_id': str(file_ids[-100])},
+                             'headers': {'X-Admin-Key': ADMIN_KEY}}),
+        'profile_get': ('profile', get(user_id=str(user_ids[0]))),
+        'profile_update': ('profile', post({'user_id': special_user_id, 'full_name': 'Plan', 'bio': 'check'})),
+        'upload': ('upload', post({'user_id': special_user_id, 'filename': 'plan.txt', 'file_content': content,
+                                   'mime_type': 'text/plain'})),
+        'upload_init': ('upload', post({'action': 'init', 'user_id': special_user_id, 'filename': 'plan.bin'})),
+        'usage_by_bytes': ('upload', {'httpMethod': 'GET', 'queryStringParameters': {'usage': '1'},
+                                      'headers': {'X-Admin-Key': ADMIN_KEY}}),
+        'set_quota': ('upload', post({'action': 'quota', 'user_id': user_ids[0], 'quota_bytes': 1 << 30},
+                                     **{'X-Admin-Key': ADMIN_KEY}))
+    }
+
+
+def main() -> None:
+    global current_scenario
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations before seeding')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--buffer-budget', type=int, default=1000, help='shared buffers one statement may touch')
+    parser.add_argument('--seq-scan-rows', type=int, default=1000,
+                        help='smaller tables may be read with a sequential scan')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('STORAGE_ROOT', tempfile.mkdtemp(prefix='vnefiles-plans-'))
+    os.environ.setdefault('RATE_LIMIT_IP_BURST', '0')
+    os.environ.setdefault('RATE_LIMIT_EMAIL_BURST', '0')
+    os.environ['ADMIN_API_KEY'] = ADMIN_KEY
+    os.environ['DOWNLOAD_FLUSH_INTERVAL'] = '0'
+    os.environ['TRACE_LOG'] = '0'
+
+    if args.migrate:
+        migrate(args.dsn)
+    user_ids, file_ids = seed(args.dsn, args.users, args.files)
+    seed_derived(args.dsn)
+
+    import psycopg2
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    # Plans are only meaningful with fresh statistics and visibility maps
+    cur.execute('VACUUM ANALYZE')
+    cur.execute("SELECT id, email FROM users WHERE id = ANY(%s) AND user_type = 'special' LIMIT 1", (user_ids,))
+    special_user_id, login_email = cur.fetchone()
+    cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace")
+    table_rows = dict(cur.fetchall())
+    conn.close()
+
+    with open(os.path.join(BACKEND, 'func2url.json')) as f:
+        functions = {name: load_function(name) for name in json.load(f)}
+    for module in functions.values():
+        module.db._pool = explaining_pool(args.dsn)
+
+    statuses = {}
+    for name, (function, event) in scenarios(functions, user_ids, file_ids, special_user_id, login_email).items():
+        current_scenario = name
+        context = types.SimpleNamespace(request_id=f'plan-{name}', function_name=function)
+        statuses[name] = functions[function].handler(event, context)['statusCode']
+
+    current_scenario = ''
+
+    failed = False
+    for result in results:
+        result['seq_scans'] = [table for table in result['seq_scans'] if table_rows.get(table, 0) >= args.seq_scan_rows]
+        prepared = re.match(r'EXECUTE (\w+)', result['query'])
+        result['buffer_budget'] = BUFFER_BUDGETS.get(prepared and prepared.group(1), args.buffer_budget)
+        result['ok'] = not result['seq_scans'] and result['shared_buffers'] <= result['buffer_budget'] and 'error' not in result
+        failed = failed or not result['ok']
+        problems = [f"seq scan on {', '.join(result['seq_scans'])}"] if result['seq_scans'] else []
+        problems += [result['error']] if 'error' in result else []
+        print(f"{'ok' if result['ok'] else 'FAIL':>4} {result['scenario']:>20}: {result['shared_buffers']:>6} buffers, "
+              f"{result['actual_ms']} ms{''.join(', ' + problem for problem in problems)}  {result['query'][:80]}",
+              file=sys.stderr)
+
+    output = json.dumps({
+        'dataset': {'users': args.users, 'files': args.files},
+        'buffer_budget': args.buffer_budget,
+        'seq_scan_rows': args.seq_scan_rows,
+        'statuses': statuses,
+        'statements': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
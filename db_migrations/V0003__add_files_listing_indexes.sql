@@ -0,0 +1,7 @@
+UPDATE files SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE files ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_files_created_at_id ON files(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_user_id_created_at_id ON files(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_mime_type_created_at_id ON files(mime_type varchar_pattern_ops, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_file_size_created_at_id ON files(file_size, created_at DESC, id DESC);
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id UUID PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    filename VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    file_size BIGINT NOT NULL,
+    storage_key TEXT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS blob_sha256 CHAR(64) REFERENCES blobs(sha256);
+
+CREATE INDEX IF NOT EXISTS idx_files_blob_sha256 ON files(blob_sha256);
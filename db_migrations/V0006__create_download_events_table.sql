@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS download_events (
+    id BIGSERIAL PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
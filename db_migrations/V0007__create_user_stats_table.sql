@@ -0,0 +1,39 @@
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    files_count BIGINT NOT NULL DEFAULT 0,
+    total_downloads BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO user_stats (user_id, files_count, total_downloads)
+SELECT user_id, COUNT(*), COALESCE(SUM(downloads_count), 0)
+FROM files
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET files_count = EXCLUDED.files_count, total_downloads = EXCLUDED.total_downloads;
+
+CREATE OR REPLACE FUNCTION user_stats_track_files() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_stats (user_id, files_count, total_downloads)
+        VALUES (NEW.user_id, 1, COALESCE(NEW.downloads_count, 0))
+        ON CONFLICT (user_id) DO UPDATE
+        SET files_count = user_stats.files_count + 1,
+            total_downloads = user_stats.total_downloads + EXCLUDED.total_downloads;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE user_stats
+        SET files_count = files_count - 1,
+            total_downloads = total_downloads - COALESCE(OLD.downloads_count, 0)
+        WHERE user_id = OLD.user_id;
+    ELSIF COALESCE(NEW.downloads_count, 0) <> COALESCE(OLD.downloads_count, 0) THEN
+        UPDATE user_stats
+        SET total_downloads = total_downloads + COALESCE(NEW.downloads_count, 0) - COALESCE(OLD.downloads_count, 0)
+        WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_files_user_stats ON files;
+CREATE TRIGGER trg_files_user_stats
+AFTER INSERT OR DELETE OR UPDATE OF downloads_count ON files
+FOR EACH ROW EXECUTE FUNCTION user_stats_track_files();
@@ -0,0 +1,43 @@
+CREATE TABLE IF NOT EXISTS catalogue_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalogue_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION catalogue_version_bump() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_LEVEL = 'STATEMENT' THEN
+        IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    UPDATE catalogue_version SET version = version + 1 WHERE id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_files_catalogue_version_insert ON files;
+CREATE TRIGGER trg_files_catalogue_version_insert
+AFTER INSERT ON files
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION catalogue_version_bump();
+
+DROP TRIGGER IF EXISTS trg_files_catalogue_version_update ON files;
+CREATE TRIGGER trg_files_catalogue_version_update
+AFTER UPDATE ON files
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION catalogue_version_bump();
+
+DROP TRIGGER IF EXISTS trg_files_catalogue_version_delete ON files;
+CREATE TRIGGER trg_files_catalogue_version_delete
+AFTER DELETE ON files
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION catalogue_version_bump();
+
+DROP TRIGGER IF EXISTS trg_users_catalogue_version ON users;
+CREATE TRIGGER trg_users_catalogue_version
+AFTER UPDATE OF email, user_type, is_verified ON users
+FOR EACH ROW
+WHEN (OLD.email IS DISTINCT FROM NEW.email OR OLD.user_type IS DISTINCT FROM NEW.user_type OR OLD.is_verified IS DISTINCT FROM NEW.is_verified)
+EXECUTE FUNCTION catalogue_version_bump();
@@ -0,0 +1,12 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_files_filename_trgm ON files USING GIN (filename gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm ON users USING GIN (email gin_trgm_ops);
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', regexp_replace(filename, '[^[:alnum:]]+', ' ', 'g'))) STORED;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', regexp_replace(email, '[^[:alnum:]]+', ' ', 'g'))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_files_search_vector ON files USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_users_search_vector ON users USING GIN (search_vector);
@@ -0,0 +1,12 @@
+ALTER TABLE files ADD COLUMN IF NOT EXISTS preview_url TEXT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS preview_mime_type VARCHAR(100);
+
+CREATE TABLE IF NOT EXISTS preview_jobs (
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_preview_jobs_run_after ON preview_jobs(run_after);
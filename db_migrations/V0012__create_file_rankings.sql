@@ -0,0 +1,35 @@
+CREATE TABLE IF NOT EXISTS ranking_windows (
+    period VARCHAR(8) PRIMARY KEY,
+    span INTERVAL,
+    expired_through TIMESTAMP NOT NULL
+);
+
+INSERT INTO ranking_windows (period, span, expired_through) VALUES
+    ('24h', INTERVAL '24 hours', date_trunc('hour', LOCALTIMESTAMP) - INTERVAL '24 hours'),
+    ('7d', INTERVAL '7 days', date_trunc('hour', LOCALTIMESTAMP) - INTERVAL '7 days'),
+    ('all', NULL, '-infinity')
+ON CONFLICT (period) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS download_buckets (
+    hour TIMESTAMP NOT NULL,
+    file_id INTEGER NOT NULL,
+    downloads BIGINT NOT NULL,
+    PRIMARY KEY (hour, file_id)
+);
+
+CREATE TABLE IF NOT EXISTS file_rankings (
+    period VARCHAR(8) NOT NULL REFERENCES ranking_windows(period),
+    file_id INTEGER NOT NULL,
+    uploader_id INTEGER NOT NULL,
+    downloads BIGINT NOT NULL,
+    PRIMARY KEY (period, file_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_rankings_top ON file_rankings(period, downloads DESC, file_id DESC);
+CREATE INDEX IF NOT EXISTS idx_file_rankings_uploader_top ON file_rankings(period, uploader_id, downloads DESC, file_id DESC);
+
+INSERT INTO file_rankings (period, file_id, uploader_id, downloads)
+SELECT 'all', id, user_id, downloads_count
+FROM files
+WHERE downloads_count > 0
+ON CONFLICT (period, file_id) DO NOTHING;
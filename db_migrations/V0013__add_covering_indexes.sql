@@ -0,0 +1,11 @@
+-- Duplicates of the users_email_key constraint index and of the idx_files_user_id_created_at_id prefix
+DROP INDEX IF EXISTS idx_users_email;
+DROP INDEX IF EXISTS idx_files_user_id;
+
+-- Login reads the whole row it needs from the index, ON CONFLICT (email) infers it like the old constraint
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_login ON users(email) INCLUDE (password_hash, id, user_type, is_verified);
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_email_key;
+
+-- Uploader columns of a listing page and the download URL lookup become index-only scans
+CREATE INDEX IF NOT EXISTS idx_users_id_listing ON users(id) INCLUDE (email, user_type, is_verified);
+CREATE INDEX IF NOT EXISTS idx_files_id_download ON files(id) INCLUDE (file_url, user_id);
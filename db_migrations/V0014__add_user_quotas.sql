@@ -0,0 +1,34 @@
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS bytes_used BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS quota_bytes BIGINT;
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS quota_files BIGINT;
+
+CREATE OR REPLACE FUNCTION user_stats_track_files() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_stats (user_id, files_count, total_downloads, bytes_used)
+        VALUES (NEW.user_id, 1, COALESCE(NEW.downloads_count, 0), NEW.file_size)
+        ON CONFLICT (user_id) DO UPDATE
+        SET files_count = user_stats.files_count + 1,
+            total_downloads = user_stats.total_downloads + EXCLUDED.total_downloads,
+            bytes_used = user_stats.bytes_used + EXCLUDED.bytes_used;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE user_stats
+        SET files_count = files_count - 1,
+            total_downloads = total_downloads - COALESCE(OLD.downloads_count, 0),
+            bytes_used = bytes_used - OLD.file_size
+        WHERE user_id = OLD.user_id;
+    ELSIF COALESCE(NEW.downloads_count, 0) <> COALESCE(OLD.downloads_count, 0) THEN
+        UPDATE user_stats
+        SET total_downloads = total_downloads + COALESCE(NEW.downloads_count, 0) - COALESCE(OLD.downloads_count, 0)
+        WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+UPDATE user_stats s
+SET bytes_used = t.bytes_used
+FROM (SELECT user_id, SUM(file_size) AS bytes_used FROM files GROUP BY user_id) t
+WHERE s.user_id = t.user_id;
+
+CREATE INDEX IF NOT EXISTS idx_user_stats_bytes_used ON user_stats(bytes_used DESC, user_id DESC);
@@ -0,0 +1,5 @@
+ALTER TABLE files ADD COLUMN IF NOT EXISTS crc32 BIGINT;
+
+-- The download action returns the checksums too, keep its lookup index-only
+DROP INDEX IF EXISTS idx_files_id_download;
+CREATE INDEX IF NOT EXISTS idx_files_id_download ON files(id) INCLUDE (file_url, user_id, blob_sha256, crc32);
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_created_at ON upload_sessions(created_at);
@@ -0,0 +1,6 @@
+-- file_url is unbounded TEXT, as an INCLUDE column a long URL exceeds the btree row size and fails
+-- the insert. Without it the download lookup reads the heap row anyway, so files_pkey serves it.
+DROP INDEX IF EXISTS idx_files_id_download;
+
+-- Same key as users_pkey, the listing join reads the heap row for the uploader columns
+DROP INDEX IF EXISTS idx_users_id_listing;
@@ -0,0 +1,281 @@
+'''
+ASGI app serving every backend function from one event loop.
+
+On the platform each function runs its synchronous handler in its own
+instance. For self-hosting this app loads backend/<name>/async_index.py of
+every function in backend/func2url.json and awaits handler_async, so one
+process serves many concurrent requests over asyncpg pools instead of one
+request per instance. A request is routed by the first path segment, which
+is either the function name or the id from its func2url URL, so the frontend
+works unchanged after pointing the function URLs at this server:
+
+    /files?limit=50
+    /adfcdc9c-946e-4291-8bd3-ca871f6f9c22?limit=50
+
+Run it with any ASGI server (uvicorn server.asgi:app) or with the small
+built-in HTTP/1.1 server:
+
+    DATABASE_URL=postgresql://localhost/vnefiles python server/asgi.py --port 8000
+'''
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import sys
+import types
+import uuid
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+MAX_BODY_BYTES = int(os.environ.get('SERVER_MAX_BODY_BYTES', str(64 * 1024 * 1024)))
+
+# Sync handlers run concurrently in the thread pool here, keep every pooled
+# connection open instead of closing the ones above the minimum on return
+os.environ.setdefault('DB_POOL_MIN_SIZE', os.environ.get('DB_POOL_MAX_SIZE', '5'))
+
+Handler = Callable[[Dict[str, Any], Any], Awaitable[Dict[str, Any]]]
+
+
+def load_function(name: str) -> Tuple[Handler, Callable[[], Awaitable[None]]]:
+    '''
+    Import backend/<name>/async_index.py with its own sibling modules and
+    return (handler_async, close_async_pool). Functions ship modules with
+    the same names (db, adb, index, ...), so those are dropped from
+    sys.modules before and after each import to keep them separate.
+    '''
+    directory = os.path.join(BACKEND, name)
+
+    def purge() -> None:
+        for module_name, module in list(sys.modules.items()):
+            if (getattr(module, '__file__', None) or '').startswith(BACKEND + os.sep):
+                del sys.modules[module_name]
+
+    purge()
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f'server_{name}', os.path.join(directory, 'async_index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        close = sys.modules['adb'].close_async_pool
+    finally:
+        sys.path.remove(directory)
+        purge()
+    return module.handler_async, close
+
+
+def load_routes() -> Tuple[Dict[str, Handler], List[Callable[[], Awaitable[None]]]]:
+    '''Route key (function name and func2url id) -> handler, and the pool closers'''
+    with open(os.path.join(BACKEND, 'func2url.json')) as f:
+        urls = json.load(f)
+
+    routes: Dict[str, Handler] = {}
+    closers = []
+    for name, url in urls.items():
+        handler, close = load_function(name)
+        routes[name] = handler
+        routes[urlsplit(url).path.strip('/')] = handler
+        closers.append(close)
+    return routes, closers
+
+
+def to_event(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    '''Cloud function event for an ASGI http scope'''
+    headers: Dict[str, str] = {}
+    for raw_name, raw_value in scope['headers']:
+        name = raw_name.decode('latin-1').title()
+        value = raw_value.decode('latin-1')
+        headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+    event: Dict[str, Any] = {
+        'httpMethod': scope['method'],
+        'path': scope['path'],
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(scope['query_string'].decode('latin-1'))),
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'identity': {'sourceIp': scope['client'][0] if scope.get('client') else None}
+        },
+        'isBase64Encoded': False,
+        'body': ''
+    }
+    if body:
+        try:
+            event['body'] = body.decode()
+        except UnicodeDecodeError:
+            event['body'] = base64.b64encode(body).decode()
+            event['isBase64Encoded'] = True
+    return event
+
+
+def from_response(response: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    '''(status, headers, body) for a cloud function response dict'''
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        payload = base64.b64decode(body)
+    else:
+        payload = body.encode() if isinstance(body, str) else body
+    headers = [
+        (str(name).encode('latin-1'), str(value).encode('latin-1'))
+        for name, value in (response.get('headers') or {}).items()
+        if str(name).lower() != 'content-length'
+    ]
+    headers.append((b'content-length', str(len(payload)).encode()))
+    return int(response.get('statusCode', 200)), headers, payload
+
+
+class App:
+    '''ASGI 3 application, functions are imported on the first request or at lifespan startup'''
+
+    def __init__(self) -> None:
+        self.routes: Optional[Dict[str, Handler]] = None
+        self.closers: List[Callable[[], Awaitable[None]]] = []
+
+    def startup(self) -> None:
+        if self.routes is None:
+            self.routes, self.closers = load_routes()
+
+    async def shutdown(self) -> None:
+        for close in self.closers:
+            await close()
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        self.startup()
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        segment = scope['path'].strip('/').split('/', 1)[0]
+        handler = self.routes.get(segment)
+        if handler is None:
+            status, headers, payload = from_response({
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Function not found'})
+            })
+        else:
+            event = to_event(scope, b''.join(chunks))
+            context = types.SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=segment)
+            status, headers, payload = from_response(await handler(event, context))
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else payload})
+
+    async def lifespan(self, receive: Any, send: Any) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = App()
+
+
+async def reject(writer: asyncio.StreamWriter, status: HTTPStatus) -> None:
+    writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    '''Minimal HTTP/1.1 with keep-alive and Content-Length bodies, enough for local use and benchmarks'''
+    client = writer.get_extra_info('peername')
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                return
+            method, target, version = request_line.decode('latin-1').split()
+
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            fields = dict(headers)
+
+            length = int(fields.get(b'content-length', b'0'))
+            if fields.get(b'transfer-encoding'):
+                await reject(writer, HTTPStatus.LENGTH_REQUIRED)
+                return
+            if length > MAX_BODY_BYTES:
+                await reject(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                return
+            body = await reader.readexactly(length) if length else b''
+
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version.split('/')[-1],
+                'method': method.upper(), 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': query.encode('latin-1'), 'headers': headers,
+                'client': client[:2] if client else None, 'server': writer.get_extra_info('sockname')[:2]
+            }
+            keep_alive = fields.get(b'connection', b'').lower() != b'close' and version == 'HTTP/1.1'
+            sent = []
+
+            async def receive() -> Dict[str, Any]:
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message: Dict[str, Any]) -> None:
+                sent.append(message)
+
+            await app(scope, receive, send)
+
+            start, message = sent
+            status = HTTPStatus(start['status'])
+            head = [f'HTTP/1.1 {status.value} {status.phrase}']
+            head += [f"{name.decode('latin-1')}: {value.decode('latin-1')}" for name, value in start['headers']]
+            head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + message['body'])
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        return
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> None:
+    app.startup()
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f'Serving backend functions on http://{host}:{port}', file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await app.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
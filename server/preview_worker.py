@@ -0,0 +1,35 @@
+'''
+Preview worker: renders thumbnails and text previews queued by uploads.
+
+Run as many workers as needed next to the functions, they share the
+preview_jobs queue in Postgres. Each one renders in a pool of --processes
+processes and uses the same storage configuration as the upload function,
+see backend/upload/previews.py.
+
+    DATABASE_URL=postgresql://localhost/vnefiles STORAGE_ROOT=/srv/vnefiles \\
+        python server/preview_worker.py --processes 4
+'''
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'upload'))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='rendering processes')
+    parser.add_argument('--batch', type=int, default=32, help='jobs claimed at once')
+    parser.add_argument('--once', action='store_true', help='exit once no job is due')
+    args = parser.parse_args()
+
+    from previews import run_worker
+    try:
+        run_worker(args.processes, args.batch, args.once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@ interface User {
   email: string;
   user_type: 'special' | 'regular';
   is_verified?: boolean;
+  token?: string | null;
 }
 
 interface ProfileData {
@@ -46,11 +47,15 @@ interface FileItem {
   uploader_type: string;
   uploader_id: number;
   uploader_verified: boolean;
+  preview_url: string | null;
+  preview_mime_type: string | null;
 }
 
 export default function Index() {
   const [user, setUser] = useState<User | null>(null);
   const [files, setFiles] = useState<FileItem[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [currentView, setCurrentView] = useState<'files' | 'profile'>('files');
   const [profileData, setProfileData] = useState<ProfileData | null>(null);
   const [viewingUserId, setViewingUserId] = useState<number | null>(null);
@@ -78,16 +83,26 @@ export default function Index() {
     loadFiles();
   }, []);
 
-  const loadFiles = async () => {
+  const loadFiles = async (cursor?: string) => {
     try {
-      const response = await fetch(FILES_URL);
+      const url = cursor ? `${FILES_URL}?cursor=${encodeURIComponent(cursor)}` : FILES_URL;
+      const response = await fetch(url);
       const data = await response.json();
-      setFiles(data.files || []);
+      const page: FileItem[] = data.files || [];
+      setFiles((current) => (cursor ? [...current, ...page] : page));
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Error loading files:', error);
     }
   };
 
+  const loadMoreFiles = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    await loadFiles(nextCursor);
+    setLoadingMore(false);
+  };
+
   const handleLogin = async () => {
     try {
       const response = await fetch(AUTH_URL, {
@@ -161,7 +176,10 @@ export default function Index() {
 
         const uploadResponse = await fetch(UPLOAD_URL, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: {
+            'Content-Type': 'application/json',
+            ...(user.token ? { 'X-Auth-Token': user.token } : {})
+          },
           body: JSON.stringify({
             user_id: user.user_id,
             filename: uploadFile.name,
@@ -487,7 +505,7 @@ export default function Index() {
                 <CardHeader>
                   <CardTitle className="flex items-center gap-2 text-base md:text-lg">
                     <Icon name="Files" size={20} />
-                    Все файлы ({files.length})
+                    Все файлы ({files.length}{nextCursor ? '+' : ''})
                   </CardTitle>
                   <CardDescription className="text-xs md:text-sm">Доступные для скачивания</CardDescription>
                 </CardHeader>
@@ -506,10 +524,19 @@ export default function Index() {
                           className="flex flex-col sm:flex-row items-start sm:items-center gap-3 sm:gap-4 p-3 md:p-4 border rounded-lg hover:bg-accent/50 transition-colors"
                         >
                           <div className="flex items-center gap-3 sm:gap-4 flex-1 w-full sm:w-auto">
-                            <div className="w-10 h-10 md:w-12 md:h-12 bg-gradient-to-br from-purple-500 to-pink-500 rounded-lg flex items-center justify-center shrink-0">
-                              <Icon name="File" size={20} className="md:hidden text-white" />
-                              <Icon name="File" size={24} className="hidden md:block text-white" />
-                            </div>
+                            {file.preview_url && file.preview_mime_type?.startsWith('image/') ? (
+                              <img
+                                src={file.preview_url}
+                                alt={file.filename}
+                                loading="lazy"
+                                className="w-10 h-10 md:w-12 md:h-12 rounded-lg object-cover shrink-0"
+                              />
+                            ) : (
+                              <div className="w-10 h-10 md:w-12 md:h-12 bg-gradient-to-br from-purple-500 to-pink-500 rounded-lg flex items-center justify-center shrink-0">
+                                <Icon name="File" size={20} className="md:hidden text-white" />
+                                <Icon name="File" size={24} className="hidden md:block text-white" />
+                              </div>
+                            )}
                             <div className="flex-1 min-w-0">
                               <p className="font-medium truncate text-sm md:text-base">{file.filename}</p>
                               <div className="flex flex-wrap items-center gap-2 md:gap-4 text-xs md:text-sm text-muted-foreground">
@@ -542,6 +569,16 @@ export default function Index() {
                           </Button>
                         </div>
                       ))}
+                      {nextCursor && (
+                        <Button
+                          onClick={loadMoreFiles}
+                          disabled={loadingMore}
+                          variant="outline"
+                          className="w-full"
+                        >
+                          {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                        </Button>
+                      )}
                     </div>
                   )}
                 </CardContent>